@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, make_response
+from flask import Flask, render_template, render_template_string, request, jsonify, session, redirect, url_for, flash, make_response, g, has_app_context, send_from_directory
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import sqlite3
@@ -7,8 +7,35 @@ import json
 import re
 import requests
 import os
-from datetime import datetime
+import queue
+import random
+import threading
+import time
+import click
+import gzip
+import base64
+import hashlib
+import mimetypes
+import math
+import atexit
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from functools import wraps
+from jinja2 import TemplateNotFound
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it only gzip is negotiated
+    brotli = None
+
+try:
+    import numpy
+except ImportError:
+    # Optional: the semantic answer index falls back to sparse dicts
+    numpy = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'  # Change this in production
@@ -59,24 +86,277 @@ def get_media_type(filename):
         return 'video'
     return None
 
+# ==========================================
+# DATABASE CONNECTION POOL
+# ==========================================
+
+DATABASE = os.getenv('LOCALFARMER_DB', 'localfarmer.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+
+# Applied once when a connection is opened, not on every checkout
+DB_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', '5000'),      # ms to wait on a locked database
+    ('cache_size', '-16000'),      # negative = KiB, i.e. ~16MB page cache
+    ('mmap_size', '134217728'),    # 128MB memory-mapped I/O
+    ('temp_store', 'MEMORY'),
+)
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to the pool"""
+
+    pool = None
+    request_scoped = False
+
+    def close(self):
+        if self.request_scoped:
+            # Released by the app context teardown, so handlers that
+            # open and close several times share one connection
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def discard(self):
+        """Really close the underlying sqlite handle"""
+        super().close()
+
+class ConnectionPool:
+    """Per-worker pool of tuned SQLite connections"""
+
+    def __init__(self, database, size):
+        self.database = database
+        self.size = size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self._reset()
+
+    def _reset(self):
+        # gunicorn forks after import, so never reuse handles from the parent
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue(maxsize=self.size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, factory=PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma, value in DB_PRAGMAS:
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+        try:
+            conn = self.idle.get_nowait()
+            with self.lock:
+                self.hits += 1
+        except queue.Empty:
+            conn = self._connect()
+            with self.lock:
+                self.misses += 1
+        return conn
+
+    def release(self, conn):
+        conn.request_scoped = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if self.pid == os.getpid():
+                self.idle.put_nowait(conn)
+                return
+        except (sqlite3.Error, queue.Full):
+            pass
+        with self.lock:
+            self.discarded += 1
+        conn.discard()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': self.size,
+                'idle': self.idle.qsize(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'discarded': self.discarded,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0
+            }
+
+db_pool = ConnectionPool(DATABASE, DB_POOL_SIZE)
+
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect('localfarmer.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get database connection (shared for the whole request when called inside one)"""
+    if has_app_context():
+        if 'db' not in g:
+            conn = db_pool.acquire()
+            conn.request_scoped = True
+            g.db = conn
+        return g.db
+    return db_pool.acquire()
+
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    """Return the request's connection to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+# ==========================================
+# METRICS
+# ==========================================
+
+# name -> callable returning a JSON-serialisable dict
+metrics_providers = {}
+
+def register_metrics(name, provider):
+    """Expose a component's counters under /api/metrics"""
+    metrics_providers[name] = provider
+
+register_metrics('db_pool', db_pool.stats)
 
 def column_exists(cursor, table_name, column_name):
     """Check if a column exists in a table"""
-    # PRAGMA doesn't support parameterized queries, but table_name is hardcoded as 'users'
+    # PRAGMA doesn't support parameterized queries, but table names are hardcoded by migrations
     cursor.execute(f"PRAGMA table_info({table_name})")
     columns = [row[1] for row in cursor.fetchall()]
     return column_name in columns
 
-def init_db():
-    """Initialize database with required tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+def add_column(cursor, table_name, column_name, column_type):
+    """Add a column unless an older database already has it"""
+    if not column_exists(cursor, table_name, column_name):
+        cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}')
+
+def rebuild_user_interests(cursor):
+    """Recompute the whole interest index from its source tables"""
+    cursor.execute('DELETE FROM user_interests')
+    cursor.execute('''
+        INSERT INTO user_interests (kind, value, user_id, weight)
+        SELECT kind, value, user_id, COUNT(*) FROM (
+            SELECT 'district' as kind, lower(trim(district)) as value, id as user_id FROM users
+            UNION ALL
+            SELECT 'mandal', lower(trim(mandal)), id FROM users
+            UNION ALL
+            SELECT 'product', lower(trim(item_name)), user_id FROM user_history
+            WHERE item_type = 'product' AND action_type != 'created'
+            UNION ALL
+            SELECT 'rental', lower(trim(r.category)), h.user_id FROM user_history h
+            JOIN rental_items r ON r.id = h.item_id
+            WHERE h.item_type = 'rental' AND h.action_type != 'created'
+            UNION ALL
+            SELECT 'product', lower(trim(p.name)), s.user_id FROM saved_items s
+            JOIN products p ON p.id = s.item_id WHERE s.item_type = 'product'
+            UNION ALL
+            SELECT 'product_category', lower(trim(p.category)), s.user_id FROM saved_items s
+            JOIN products p ON p.id = s.item_id WHERE s.item_type = 'product'
+            UNION ALL
+            SELECT 'rental', lower(trim(r.category)), s.user_id FROM saved_items s
+            JOIN rental_items r ON r.id = s.item_id WHERE s.item_type = 'rental'
+            UNION ALL
+            SELECT 'product', lower(trim(product_name)), user_id FROM customer_requirements WHERE user_id IS NOT NULL
+            UNION ALL
+            SELECT 'sells', lower(trim(name)), user_id FROM products
+            UNION ALL
+            SELECT 'rents_out', lower(trim(category)), user_id FROM rental_items
+            UNION ALL
+            SELECT 'rental', lower(trim(rental_category)), user_id FROM rental_requirements WHERE user_id IS NOT NULL
+        )
+        WHERE COALESCE(value, '') != '' AND user_id IS NOT NULL
+        GROUP BY kind, value, user_id
+    ''')
+
+# (entity_type, feedback table, column naming the rated entity)
+RATING_SOURCES = [
+    ('rental', 'rental_feedback', 'rental_id'),
+    ('product', 'user_feedback', 'product_id'),
+    ('farmer', 'user_feedback', 'farmer_id'),
+    ('reviewer', 'user_feedback', 'user_id'),
+    ('live_price', 'live_price_feedback', 'price_id'),
+]
+
+def rebuild_rating_stats(cursor):
+    """Recompute every rating aggregate from the feedback tables"""
+    cursor.execute('DELETE FROM rating_stats')
+    for entity_type, table_name, column in RATING_SOURCES:
+        cursor.execute(f'''
+            INSERT INTO rating_stats (entity_type, entity_id, rating_sum, rating_count)
+            SELECT ?, {column}, SUM(rating), COUNT(*)
+            FROM {table_name}
+            WHERE {column} IS NOT NULL
+            GROUP BY {column}
+        ''', (entity_type,))
+
+def rating_summary(cursor, entity_type, entity_id):
+    """(average, count) for an entity from the precomputed rating_stats"""
+    cursor.execute('''
+        SELECT rating_sum, rating_count FROM rating_stats
+        WHERE entity_type = ? AND entity_id = ?
+    ''', (entity_type, entity_id))
+    row = cursor.fetchone()
+    if not row or not row['rating_count']:
+        return 0, 0
+    return row['rating_sum'] / row['rating_count'], row['rating_count']
+
+# (user_counters column, source table, row condition) - one counter per profile stat
+USER_COUNTER_SOURCES = [
+    ('products_posted', 'products', '1'),
+    ('rentals_posted', 'rental_items', '1'),
+    ('product_requirements', 'customer_requirements', '1'),
+    ('rental_requirements', 'rental_requirements', '1'),
+    ('contacts_made', 'user_history', "action_type = 'contacted'"),
+]
+
+def rebuild_user_counters(cursor):
+    """Recompute every per-user counter from the source tables"""
+    cursor.execute('DELETE FROM user_counters')
+    columns = [column for column, _, _ in USER_COUNTER_SOURCES]
+    parts = []
+    for column, table_name, condition in USER_COUNTER_SOURCES:
+        flags = ', '.join(f"{int(other == column)} as {other}" for other in columns)
+        parts.append(f'SELECT user_id, {flags} FROM {table_name} WHERE user_id IS NOT NULL AND {condition}')
+    cursor.execute(f'''
+        INSERT INTO user_counters (user_id, {', '.join(columns)})
+        SELECT user_id, {', '.join(f'SUM({column})' for column in columns)}
+        FROM ({' UNION ALL '.join(parts)})
+        GROUP BY user_id
+    ''')
+
+# Public collections whose version is bumped by triggers whenever rows they
+# render change: (collection, table, events, row condition)
+LISTING_EVENTS = ('INSERT', 'UPDATE', 'DELETE')
+USER_DISPLAY_UPDATE = ('UPDATE OF name, phone, location',)
+COLLECTION_SOURCES = [
+    ('products', 'products', LISTING_EVENTS, '1'),
+    ('products', 'users', USER_DISPLAY_UPDATE, '1'),
+    ('rentals', 'rental_items', LISTING_EVENTS, '1'),
+    ('rentals', 'users', USER_DISPLAY_UPDATE, '1'),
+    ('rentals', 'rating_stats', LISTING_EVENTS, "entity_type = 'rental'"),
+    ('requirements', 'customer_requirements', LISTING_EVENTS, '1'),
+    ('rental_requirements', 'rental_requirements', LISTING_EVENTS, '1'),
+    ('schemes', 'government_schemes', LISTING_EVENTS, '1'),
+    ('live_prices', 'live_prices', LISTING_EVENTS, '1'),
+    ('live_prices', 'users', USER_DISPLAY_UPDATE, '1'),
+    ('live_prices', 'rating_stats', LISTING_EVENTS, "entity_type = 'live_price'"),
+]
+
+# Query parameters accepted by GET /api/live-prices (case-insensitive exact match)
+LIVE_PRICE_FILTERS = ('state', 'district', 'category', 'product_name')
+# Columns matched by the feed's free-text q= search (substring, case-insensitive)
+LIVE_PRICE_SEARCH_COLUMNS = ('product_name', 'area', 'city', 'district', 'state')
+
+# ==========================================
+# SCHEMA MIGRATIONS
+# ==========================================
+# Each step runs exactly once per database and is recorded in schema_version.
+# Never edit a shipped step - append a new one to MIGRATIONS instead.
+
+def migration_0001_initial_schema(cursor):
+    """Baseline schema; idempotent so databases created before versioning adopt it"""
     # Users table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -96,24 +376,14 @@ def init_db():
         )
     ''')
     
-    # Add new columns if they don't exist (for existing databases)
-    columns_to_add = [
-        ('village', 'TEXT'),
-        ('mandal', 'TEXT'),
-        ('district', 'TEXT'),
-        ('user_type', 'TEXT'),
-        ('preferred_language', 'TEXT'),
-        ('phone_verified', 'INTEGER DEFAULT 0')
-    ]
-    
-    for col_name, col_type in columns_to_add:
-        if not column_exists(cursor, 'users', col_name):
-            try:
-                cursor.execute(f'ALTER TABLE users ADD COLUMN {col_name} {col_type}')
-            except Exception as e:
-                print(f"Warning: Could not add column {col_name}: {e}")
-    
-    conn.commit()
+    # Columns added after the first release
+    add_column(cursor, 'users', 'village', 'TEXT')
+    add_column(cursor, 'users', 'mandal', 'TEXT')
+    add_column(cursor, 'users', 'district', 'TEXT')
+    add_column(cursor, 'users', 'user_type', "TEXT DEFAULT 'farmer'")
+    add_column(cursor, 'users', 'preferred_language', "TEXT DEFAULT 'en'")
+    add_column(cursor, 'users', 'phone_verified', 'INTEGER DEFAULT 0')
+    add_column(cursor, 'users', 'profile_photo', 'TEXT')
     
     # Products table
     cursor.execute('''
@@ -131,6 +401,7 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
+    add_column(cursor, 'products', 'status', "TEXT DEFAULT 'active'")
     
     # Customer requirements table
     cursor.execute('''
@@ -144,6 +415,11 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    add_column(cursor, 'customer_requirements', 'user_id', 'INTEGER')
+    add_column(cursor, 'customer_requirements', 'status', "TEXT DEFAULT 'active'")
+    add_column(cursor, 'customer_requirements', 'pin_code', "TEXT DEFAULT ''")
+    add_column(cursor, 'customer_requirements', 'special_instructions', "TEXT DEFAULT ''")
+    add_column(cursor, 'customer_requirements', 'preferred_delivery_date', "TEXT DEFAULT ''")
     
     # Transactions table
     cursor.execute('''
@@ -274,20 +550,13 @@ def init_db():
             UNIQUE(product_id, user_id)
         )
     ''')
-    
-    # Add images and videos columns if they don't exist (for existing databases)
-    try:
-        cursor.execute('ALTER TABLE user_feedback ADD COLUMN images TEXT')
-    except:
-        pass
-    try:
-        cursor.execute('ALTER TABLE user_feedback ADD COLUMN videos TEXT')
-    except:
-        pass
+    add_column(cursor, 'user_feedback', 'images', 'TEXT')
+    add_column(cursor, 'user_feedback', 'videos', 'TEXT')
     try:
         cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_product_user_feedback ON user_feedback(product_id, user_id)')
-    except:
-        pass
+    except sqlite3.IntegrityError as e:
+        # Old databases may hold duplicate reviews; the handler still rejects new ones
+        print(f"Warning: Could not create idx_product_user_feedback: {e}")
     
     # Rental requirements table
     cursor.execute('''
@@ -335,55 +604,10 @@ def init_db():
         )
     ''')
     
-    # Add user_id column to customer_requirements if not exists
-    try:
-        cursor.execute('ALTER TABLE customer_requirements ADD COLUMN user_id INTEGER')
-    except:
-        pass
-    
-    # Add status column to customer_requirements if not exists
-    try:
-        cursor.execute('ALTER TABLE customer_requirements ADD COLUMN status TEXT DEFAULT "active"')
-    except:
-        pass
-    
-    # Add pin_code column to customer_requirements if not exists
-    try:
-        cursor.execute('ALTER TABLE customer_requirements ADD COLUMN pin_code TEXT DEFAULT ""')
-    except:
-        pass
-    
-    # Add special_instructions column to customer_requirements if not exists
-    try:
-        cursor.execute('ALTER TABLE customer_requirements ADD COLUMN special_instructions TEXT DEFAULT ""')
-    except:
-        pass
-    
-    # Add preferred_delivery_date column to customer_requirements if not exists
-    try:
-        cursor.execute('ALTER TABLE customer_requirements ADD COLUMN preferred_delivery_date TEXT DEFAULT ""')
-    except:
-        pass
-    
-    # Add status column to products if not exists
-    try:
-        cursor.execute('ALTER TABLE products ADD COLUMN status TEXT DEFAULT "active"')
-    except:
-        pass
-    
-    # Add user_type, preferred_language, profile_photo columns to users if not exists
-    try:
-        cursor.execute('ALTER TABLE users ADD COLUMN user_type TEXT DEFAULT "farmer"')
-    except:
-        pass
-    try:
-        cursor.execute('ALTER TABLE users ADD COLUMN preferred_language TEXT DEFAULT "en"')
-    except:
-        pass
-    try:
-        cursor.execute('ALTER TABLE users ADD COLUMN profile_photo TEXT')
-    except:
-        pass
+    # Live price feedback used to be keyed differently; old copies carry no data worth keeping
+    if column_exists(cursor, 'live_price_feedback', 'id') and not column_exists(cursor, 'live_price_feedback', 'price_id'):
+        print("Migrating live_price_feedback table...")
+        cursor.execute('DROP TABLE live_price_feedback')
     
     # Live prices table
     cursor.execute('''
@@ -426,42 +650,1756 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
+
+def migration_0002_hot_query_indexes(cursor):
+    """Secondary indexes for the predicates and sort orders the routes use"""
+    statements = [
+        # Notification feed, unread badge and per-category tabs
+        'CREATE INDEX IF NOT EXISTS idx_notifications_user_read_created ON notifications(user_id, is_read, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_user_category_created ON notifications(user_id, category, created_at)',
+        # History listing, stats and the "contacts made" profile counter
+        'CREATE INDEX IF NOT EXISTS idx_user_history_user_created ON user_history(user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_user_history_user_action ON user_history(user_id, action_type)',
+        # Live prices are only shown for 24 hours
+        'CREATE INDEX IF NOT EXISTS idx_live_prices_created ON live_prices(created_at)',
+        # Covering (key, rating) so averages and counts never touch the table
+        'CREATE INDEX IF NOT EXISTS idx_live_price_feedback_price_rating ON live_price_feedback(price_id, rating)',
+        'CREATE INDEX IF NOT EXISTS idx_rental_feedback_rental_rating ON rental_feedback(rental_id, rating)',
+        'CREATE INDEX IF NOT EXISTS idx_user_feedback_farmer_rating ON user_feedback(farmer_id, rating)',
+        'CREATE INDEX IF NOT EXISTS idx_user_feedback_user_created ON user_feedback(user_id, created_at)',
+        # Public listings (newest first) and "my ..." profile tabs
+        'CREATE INDEX IF NOT EXISTS idx_products_created ON products(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_products_user_created ON products(user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_rental_items_created ON rental_items(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_rental_items_user_created ON rental_items(user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_rental_media_rental_uploaded ON rental_media(rental_id, uploaded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_customer_requirements_created ON customer_requirements(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_customer_requirements_user_created ON customer_requirements(user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_rental_requirements_user_created ON rental_requirements(user_id, created_at)',
+        "CREATE INDEX IF NOT EXISTS idx_rental_requirements_active_created ON rental_requirements(created_at) WHERE status = 'active'",
+        'CREATE INDEX IF NOT EXISTS idx_government_schemes_created ON government_schemes(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user_created ON transactions(user_id, created_at)',
+        # Lookups by name (feedback form) and email (profile uniqueness check)
+        'CREATE INDEX IF NOT EXISTS idx_users_name ON users(name)',
+        'CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)',
+    ]
+    for statement in statements:
+        cursor.execute(statement)
+
+def migration_0003_broadcast_announcements(cursor):
+    """One announcements row per post instead of one notifications row per user"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS announcements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL CHECK(category IN ('product_posted', 'rental_posted', 'product_requirement_posted', 'rental_requirement_posted')),
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            related_item_id INTEGER,
+            related_item_type TEXT,
+            exclude_user_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (exclude_user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_announcements_created ON announcements(created_at)')
+    
+    # Per-user state only for announcements a user has touched individually
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS announcement_reads (
+            user_id INTEGER NOT NULL,
+            announcement_id INTEGER NOT NULL,
+            is_read INTEGER DEFAULT 1,
+            is_deleted INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, announcement_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (announcement_id) REFERENCES announcements (id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # "Mark all as read" just moves the cursor: every announcement id <= read_through_id is read
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_cursors (
+            user_id INTEGER PRIMARY KEY,
+            read_through_id INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+def migration_0004_notification_outbox(cursor):
+    """Durable queue of notifications waiting to be fanned out by the worker"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            related_item_id INTEGER,
+            related_item_type TEXT,
+            audience TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'done', 'failed')),
+            cursor_user_id INTEGER NOT NULL DEFAULT 0,
+            delivered_count INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending ON notification_outbox(id) WHERE status = 'pending'")
+
+def migration_0005_user_interests(cursor):
+    """Interest index used to target notifications, kept current by triggers"""
+    # kind: district / mandal (where the user farms), product / product_category
+    # (what they look for), sells (what they post), rental / rents_out
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_interests (
+            kind TEXT NOT NULL,
+            value TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            weight INTEGER NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (kind, value, user_id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_interests_user ON user_interests(user_id)')
+    
+    # (trigger name, table, event, [(kind, value expression, user expression, condition)])
+    sources = [
+        ('trg_interests_users_insert', 'users', 'INSERT', [
+            ('district', 'NEW.district', 'NEW.id', '1'),
+            ('mandal', 'NEW.mandal', 'NEW.id', '1'),
+        ]),
+        ('trg_interests_user_history_insert', 'user_history', 'INSERT', [
+            ('product', 'NEW.item_name', 'NEW.user_id', "NEW.item_type = 'product' AND NEW.action_type != 'created'"),
+            ('rental', '(SELECT category FROM rental_items WHERE id = NEW.item_id)', 'NEW.user_id',
+             "NEW.item_type = 'rental' AND NEW.action_type != 'created'"),
+        ]),
+        ('trg_interests_saved_items_insert', 'saved_items', 'INSERT', [
+            ('product', '(SELECT name FROM products WHERE id = NEW.item_id)', 'NEW.user_id', "NEW.item_type = 'product'"),
+            ('product_category', '(SELECT category FROM products WHERE id = NEW.item_id)', 'NEW.user_id', "NEW.item_type = 'product'"),
+            ('rental', '(SELECT category FROM rental_items WHERE id = NEW.item_id)', 'NEW.user_id', "NEW.item_type = 'rental'"),
+        ]),
+        ('trg_interests_customer_requirements_insert', 'customer_requirements', 'INSERT', [
+            ('product', 'NEW.product_name', 'NEW.user_id', 'NEW.user_id IS NOT NULL'),
+        ]),
+        ('trg_interests_products_insert', 'products', 'INSERT', [
+            ('sells', 'NEW.name', 'NEW.user_id', '1'),
+        ]),
+        ('trg_interests_rental_items_insert', 'rental_items', 'INSERT', [
+            ('rents_out', 'NEW.category', 'NEW.user_id', '1'),
+        ]),
+        ('trg_interests_rental_requirements_insert', 'rental_requirements', 'INSERT', [
+            ('rental', 'NEW.rental_category', 'NEW.user_id', 'NEW.user_id IS NOT NULL'),
+        ]),
+    ]
+    for trigger_name, table_name, event, interests in sources:
+        body = ''.join(f'''
+            INSERT INTO user_interests (kind, value, user_id)
+            SELECT '{kind}', lower(trim({value})), {user}
+            WHERE {condition} AND COALESCE(trim({value}), '') != ''
+            ON CONFLICT(kind, value, user_id) DO UPDATE SET weight = weight + 1, updated_at = CURRENT_TIMESTAMP;'''
+            for kind, value, user, condition in interests)
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger_name}')
+        cursor.execute(f'CREATE TRIGGER {trigger_name} AFTER {event} ON {table_name} BEGIN {body} END')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_interests_users_location
+        AFTER UPDATE OF district, mandal ON users
+        BEGIN
+            DELETE FROM user_interests WHERE user_id = NEW.id AND kind IN ('district', 'mandal');
+            INSERT OR IGNORE INTO user_interests (kind, value, user_id)
+            SELECT 'district', lower(trim(NEW.district)), NEW.id WHERE COALESCE(trim(NEW.district), '') != '';
+            INSERT OR IGNORE INTO user_interests (kind, value, user_id)
+            SELECT 'mandal', lower(trim(NEW.mandal)), NEW.id WHERE COALESCE(trim(NEW.mandal), '') != '';
+        END
+    ''')
+    rebuild_user_interests(cursor)
+
+def migration_0006_rating_stats(cursor):
+    """Per-entity rating sum/count kept current by triggers on the feedback tables"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rating_stats (
+            entity_type TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (entity_type, entity_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    def add(entity_type, column, row, sign):
+        return f'''
+            INSERT INTO rating_stats (entity_type, entity_id, rating_sum, rating_count)
+            SELECT '{entity_type}', {row}.{column}, {sign}{row}.rating, {sign}1 WHERE {row}.{column} IS NOT NULL
+            ON CONFLICT(entity_type, entity_id) DO UPDATE SET
+                rating_sum = rating_sum + excluded.rating_sum,
+                rating_count = rating_count + excluded.rating_count;'''
+    
+    tables = {}
+    for entity_type, table_name, column in RATING_SOURCES:
+        tables.setdefault(table_name, []).append((entity_type, column))
+    for table_name, entities in tables.items():
+        removed = ''.join(add(entity_type, column, 'OLD', '-') for entity_type, column in entities)
+        removed += ''.join(f'''
+            DELETE FROM rating_stats WHERE entity_type = '{entity_type}' AND entity_id = OLD.{column} AND rating_count <= 0;'''
+            for entity_type, column in entities)
+        inserted = ''.join(add(entity_type, column, 'NEW', '') for entity_type, column in entities)
+        columns = ', '.join(['rating'] + [column for _, column in entities])
+        for suffix, event, body in (
+            ('insert', 'INSERT', inserted),
+            ('delete', 'DELETE', removed),
+            ('update', f'UPDATE OF {columns}', removed + inserted),
+        ):
+            trigger_name = f'trg_rating_stats_{table_name}_{suffix}'
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger_name}')
+            cursor.execute(f'CREATE TRIGGER {trigger_name} AFTER {event} ON {table_name} BEGIN {body} END')
+    rebuild_rating_stats(cursor)
+
+def migration_0007_live_price_filters(cursor):
+    """Indexes for the filtered live price feed, newest first within each filter"""
+    for column in LIVE_PRICE_FILTERS:
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_live_prices_{column}_created
+            ON live_prices({column} COLLATE NOCASE, created_at)
+        ''')
+
+def migration_0008_user_counters(cursor):
+    """Per-user profile counters kept current by insert/delete triggers"""
+    columns = ''.join(f',\n            {column} INTEGER NOT NULL DEFAULT 0' for column, _, _ in USER_COUNTER_SOURCES)
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS user_counters (
+            user_id INTEGER PRIMARY KEY{columns}
+        )
+    ''')
+    for column, table_name, condition in USER_COUNTER_SOURCES:
+        triggers = {
+            'insert': f'''
+                INSERT INTO user_counters (user_id, {column})
+                SELECT NEW.user_id, 1 WHERE NEW.user_id IS NOT NULL AND {condition.replace('action_type', 'NEW.action_type')}
+                ON CONFLICT(user_id) DO UPDATE SET {column} = {column} + 1;''',
+            'delete': f'''
+                UPDATE user_counters SET {column} = MAX({column} - 1, 0)
+                WHERE user_id = OLD.user_id AND {condition.replace('action_type', 'OLD.action_type')};''',
+        }
+        for suffix, body in triggers.items():
+            trigger_name = f'trg_user_counters_{table_name}_{suffix}'
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger_name}')
+            cursor.execute(f'CREATE TRIGGER {trigger_name} AFTER {suffix.upper()} ON {table_name} BEGIN {body} END')
+    rebuild_user_counters(cursor)
+
+def migration_0009_collection_versions(cursor):
+    """Version stamp per public collection, bumped by triggers on every change"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS collection_versions (
+            collection TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    for collection, table_name, events, condition in COLLECTION_SOURCES:
+        cursor.execute('INSERT OR IGNORE INTO collection_versions (collection, version) VALUES (?, 1)', (collection,))
+        for event in events:
+            row = 'OLD' if event == 'DELETE' else 'NEW'
+            when = '' if condition == '1' else f' WHEN {row}.{condition}'
+            trigger_name = f"trg_version_{collection}_{table_name}_{event.split()[0].lower()}"
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger_name}')
+            cursor.execute(f'''
+                CREATE TRIGGER {trigger_name} AFTER {event} ON {table_name}{when}
+                BEGIN
+                    UPDATE collection_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE collection = '{collection}';
+                END
+            ''')
+
+def migration_0010_event_log(cursor):
+    """Append-only change feed read by each worker's push hub"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS event_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL,
+            event TEXT NOT NULL,
+            ref_id INTEGER,
+            payload TEXT NOT NULL DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_event_log_channel_id ON event_log(channel, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_event_log_created ON event_log(created_at)')
+    # One creation/expiry event per post, however many workers notice it
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_event_log_once
+        ON event_log(event, ref_id) WHERE ref_id IS NOT NULL
+    ''')
+    
+    cursor.execute('DROP TRIGGER IF EXISTS trg_events_live_price_created')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_events_live_price_created AFTER INSERT ON live_prices
+        BEGIN
+            INSERT OR IGNORE INTO event_log (channel, event, ref_id, payload)
+            VALUES ('live_prices', 'price_created', NEW.id, json_object(
+                'id', NEW.id, 'user_id', NEW.user_id,
+                'poster_name', (SELECT name FROM users WHERE id = NEW.user_id),
+                'product_name', NEW.product_name, 'category', NEW.category,
+                'min_price', NEW.min_price, 'max_price', NEW.max_price,
+                'price_unit', NEW.price_unit, 'price_trend', NEW.price_trend,
+                'market_name', NEW.market_name, 'phone', NEW.phone,
+                'area', NEW.area, 'city', NEW.city, 'district', NEW.district,
+                'state', NEW.state, 'pin_code', NEW.pin_code,
+                'latitude', NEW.latitude, 'longitude', NEW.longitude,
+                'images', json(COALESCE(NEW.images, '[]')),
+                'videos', json(COALESCE(NEW.videos, '[]')),
+                'feedback_count', 0, 'avg_rating', 0,
+                'created_at', NEW.created_at
+            ));
+        END
+    ''')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_events_live_price_feedback')
+    cursor.execute('''
+        CREATE TRIGGER trg_events_live_price_feedback AFTER INSERT ON live_price_feedback
+        BEGIN
+            INSERT INTO event_log (channel, event, payload)
+            SELECT 'live_prices', 'feedback', json_object(
+                'price_id', lp.id, 'rating', NEW.rating,
+                'feedback_count', (SELECT COUNT(*) FROM live_price_feedback WHERE price_id = lp.id),
+                'avg_rating', (SELECT ROUND(AVG(rating), 1) FROM live_price_feedback WHERE price_id = lp.id),
+                'state', lp.state, 'district', lp.district, 'category', lp.category
+            )
+            FROM live_prices lp WHERE lp.id = NEW.price_id;
+        END
+    ''')
+
+# Anything that can change a user's unread count: (trigger name, event, WHEN, user id)
+NOTIFICATION_READ_STATE_CHANGES = [
+    ('notification_read', 'UPDATE OF is_read ON notifications', 'OLD.is_read IS NOT NEW.is_read', 'NEW.user_id'),
+    ('notification_deleted', 'DELETE ON notifications', 'OLD.is_read = 0', 'OLD.user_id'),
+    ('announcement_read', 'INSERT ON announcement_reads', '1', 'NEW.user_id'),
+    ('announcement_read_update', 'UPDATE ON announcement_reads', '1', 'NEW.user_id'),
+    ('cursor_insert', 'INSERT ON notification_cursors', '1', 'NEW.user_id'),
+    ('cursor_update', 'UPDATE ON notification_cursors', '1', 'NEW.user_id'),
+]
+
+def migration_0011_notification_events(cursor):
+    """Feed new notifications and read-state changes into event_log for push"""
+    # Personal rows carry user_id; broadcasts carry exclude_user_id instead
+    cursor.execute('DROP TRIGGER IF EXISTS trg_events_notification_created')
+    cursor.execute('''
+        CREATE TRIGGER trg_events_notification_created AFTER INSERT ON notifications
+        BEGIN
+            INSERT INTO event_log (channel, event, payload)
+            VALUES ('notifications', 'notification', json_object(
+                'id', NEW.id, 'kind', 'notification', 'user_id', NEW.user_id,
+                'category', NEW.category, 'title', NEW.title, 'message', NEW.message,
+                'related_item_id', NEW.related_item_id, 'related_item_type', NEW.related_item_type,
+                'is_read', json(CASE WHEN NEW.is_read THEN 'true' ELSE 'false' END),
+                'created_at', NEW.created_at
+            ));
+        END
+    ''')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_events_announcement_created')
+    cursor.execute('''
+        CREATE TRIGGER trg_events_announcement_created AFTER INSERT ON announcements
+        BEGIN
+            INSERT INTO event_log (channel, event, payload)
+            VALUES ('notifications', 'notification', json_object(
+                'id', NEW.id, 'kind', 'announcement', 'user_id', NULL,
+                'exclude_user_id', NEW.exclude_user_id,
+                'category', NEW.category, 'title', NEW.title, 'message', NEW.message,
+                'related_item_id', NEW.related_item_id, 'related_item_type', NEW.related_item_type,
+                'is_read', json('false'), 'created_at', NEW.created_at
+            ));
+        END
+    ''')
+    
+    for name, event, condition, user_id in NOTIFICATION_READ_STATE_CHANGES:
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_events_{name}')
+        cursor.execute(f'''
+            CREATE TRIGGER trg_events_{name} AFTER {event}
+            WHEN {condition}
+            BEGIN
+                INSERT INTO event_log (channel, event, payload)
+                VALUES ('notifications', 'read_state', json_object('user_id', {user_id}));
+            END
+        ''')
+
+def migration_0012_ai_answer_cache(cursor):
+    """Answers to /api/ai/chat questions, keyed on the normalized question"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_answer_cache (
+            cache_key TEXT PRIMARY KEY,
+            question TEXT NOT NULL,
+            language TEXT NOT NULL,
+            crop_context TEXT NOT NULL DEFAULT '',
+            answer TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+    # Expiry sweep and least-recently-used eviction
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ai_answer_cache_created ON ai_answer_cache(created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ai_answer_cache_last_hit ON ai_answer_cache(last_hit_at)')
+
+# Emoji headings the crop prompt asks for; matched by emoji so translated
+# titles still parse. Slugs are the ?sections= names.
+CROP_SECTIONS = [
+    ('overview', '🧠', 'Crop Overview'),
+    ('growth', '🧭', 'Growth Stages & Duration'),
+    ('soil', '🌱', 'Soil & Climate Requirements'),
+    ('fertilizers', '🧪', 'Fertilisers & Nutrient Management'),
+    ('pests', '🐛', 'Pest & Disease Management'),
+    ('irrigation', '💧', 'Irrigation & Water Management'),
+    ('cultivation', '🚜', 'Cultivation Steps'),
+    ('post_harvest', '📦', 'Post-Harvest Handling & Storage'),
+    ('market', '📈', 'Market Intelligence'),
+    ('varieties', '🌾', 'Popular Varieties'),
+    ('climate', '☀', 'Climate & Weather Forecast'),
+    ('summary', '🔍', 'AI Suitability & Recommendation Summary'),
+]
+CROP_SECTION_TITLES = {slug: title for slug, _, title in CROP_SECTIONS}
+
+def parse_crop_sections(text):
+    """Split a generated guide into {slug: body} at its emoji headings"""
+    sections = {}
+    current = None
+    for line in text.split('\n'):
+        heading = line.strip().lstrip('#*').strip()
+        slug = next((slug for slug, emoji, _ in CROP_SECTIONS if heading.startswith(emoji)), None)
+        if slug and len(heading) < 120:
+            current = slug
+            sections.setdefault(current, [])
+        elif current:
+            sections[current].append(line)
+    parsed = {slug: '\n'.join(lines).strip() for slug, lines in sections.items()}
+    # A guide without the expected headings is kept whole as the overview
+    return parsed or {'overview': text.strip()}
+
+def migration_0013_crop_details(cursor):
+    """Generated crop guides, zlib-compressed, one row per crop and language"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crop_details (
+            crop_key TEXT NOT NULL,
+            language TEXT NOT NULL,
+            crop_name TEXT NOT NULL,
+            body BLOB NOT NULL,
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            request_count INTEGER NOT NULL DEFAULT 0,
+            last_requested_at TIMESTAMP,
+            PRIMARY KEY (crop_key, language)
+        ) WITHOUT ROWID
+    ''')
+
+def migration_0014_rate_budgets(cursor):
+    """Token buckets shared by every process that calls a paid upstream"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rate_budgets (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+def migration_0015_crop_detail_sections(cursor):
+    """Crop guides split per section so clients can fetch one part"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crop_detail_sections (
+            crop_key TEXT NOT NULL,
+            language TEXT NOT NULL,
+            section TEXT NOT NULL,
+            body BLOB NOT NULL,
+            PRIMARY KEY (crop_key, language, section)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('SELECT crop_key, language, body FROM crop_details')
+    for row in cursor.fetchall():
+        sections = parse_crop_sections(zlib.decompress(row['body']).decode('utf-8'))
+        cursor.executemany('''
+            INSERT OR REPLACE INTO crop_detail_sections (crop_key, language, section, body)
+            VALUES (?, ?, ?, ?)
+        ''', [(row['crop_key'], row['language'], slug, zlib.compress(body.encode('utf-8'), 6))
+              for slug, body in sections.items()])
+
+def migration_0016_event_log_user(cursor):
+    """Per-user events carry user_id so a reconnect only replays its own; fan-out logs one event per batch"""
+    add_column(cursor, 'event_log', 'user_id', 'INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_event_log_channel_user_id ON event_log(channel, user_id, id)')
+    # NotificationFanoutWorker writes the notification event with each batch
+    cursor.execute('DROP TRIGGER IF EXISTS trg_events_notification_created')
+    for name, event, condition, user_id in NOTIFICATION_READ_STATE_CHANGES:
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_events_{name}')
+        cursor.execute(f'''
+            CREATE TRIGGER trg_events_{name} AFTER {event}
+            WHEN {condition}
+            BEGIN
+                INSERT INTO event_log (channel, event, user_id, payload)
+                VALUES ('notifications', 'read_state', {user_id}, json_object('user_id', {user_id}));
+            END
+        ''')
+
+# Ordered (version, name, step); versions must be strictly increasing
+MIGRATIONS = [
+    (1, 'initial schema', migration_0001_initial_schema),
+    (2, 'hot query indexes', migration_0002_hot_query_indexes),
+    (3, 'broadcast announcements', migration_0003_broadcast_announcements),
+    (4, 'notification outbox', migration_0004_notification_outbox),
+    (5, 'user interests', migration_0005_user_interests),
+    (6, 'rating stats', migration_0006_rating_stats),
+    (7, 'live price filter indexes', migration_0007_live_price_filters),
+    (8, 'user counters', migration_0008_user_counters),
+    (9, 'collection versions', migration_0009_collection_versions),
+    (10, 'event log', migration_0010_event_log),
+    (11, 'notification events', migration_0011_notification_events),
+    (12, 'ai answer cache', migration_0012_ai_answer_cache),
+    (13, 'crop details', migration_0013_crop_details),
+    (14, 'rate budgets', migration_0014_rate_budgets),
+    (15, 'crop detail sections', migration_0015_crop_detail_sections),
+    (16, 'event log user', migration_0016_event_log_user),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    """Current schema version (0 for a database that predates versioning)"""
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+def apply_migrations(conn, target=None):
+    """Apply pending migrations up to target; returns the versions applied"""
+    target = SCHEMA_VERSION if target is None else target
+    if conn.in_transaction:
+        conn.commit()
     
-    # Migration: Check if old schema exists and migrate if needed
+    # IMMEDIATE takes the write lock up front so concurrently booting
+    # workers queue here instead of racing through the same DDL
+    conn.execute('BEGIN IMMEDIATE')
     try:
-        cursor.execute("PRAGMA table_info(live_price_feedback)")
-        columns = [col[1] for col in cursor.fetchall()]
-        
-        # If table exists but doesn't have price_id column, recreate it
-        if columns and 'price_id' not in columns:
-            print("Migrating live_price_feedback table...")
-            cursor.execute('DROP TABLE IF EXISTS live_price_feedback')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        current = get_schema_version(conn)
+        applied = []
+        cursor = conn.cursor()
+        for version, name, step in MIGRATIONS:
+            if version <= current or version > target:
+                continue
+            step(cursor)
+            cursor.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            applied.append(version)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+def init_db():
+    """Initialize database by applying any pending schema migrations"""
+    conn = get_db_connection()
+    try:
+        applied = apply_migrations(conn)
+    finally:
+        conn.close()
+    for version in applied:
+        print(f"Applied schema migration {version}")
+    return applied
+
+def ensure_schema():
+    """Worker cold-start check: a single read unless the schema is behind"""
+    conn = get_db_connection()
+    try:
+        current = get_schema_version(conn)
+    finally:
+        conn.close()
+    if current >= SCHEMA_VERSION:
+        return
+    if os.getenv('AUTO_MIGRATE', '1') != '1':
+        # Deploys that migrate out-of-band; don't block importing the app (the CLI needs it)
+        print(f"Warning: schema is at version {current}, expected {SCHEMA_VERSION}. "
+              "Run 'flask --app app migrate'.")
+        return
+    init_db()
+
+@app.cli.command('migrate')
+@click.option('--to', 'target', type=int, default=None, help='Stop at this schema version')
+def migrate_command(target):
+    """Apply pending schema migrations"""
+    conn = get_db_connection()
+    try:
+        before = get_schema_version(conn)
+        applied = apply_migrations(conn, target)
+        after = get_schema_version(conn)
+    finally:
+        conn.close()
+    for version in applied:
+        click.echo(f'Applied migration {version}')
+    click.echo(f'Schema version {before} -> {after} (latest {SCHEMA_VERSION})')
+
+@app.cli.command('rebuild-counters')
+def rebuild_counters_command():
+    """Recompute user_counters and rating_stats from the source tables"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        rebuild_user_counters(cursor)
+        rebuild_rating_stats(cursor)
+        conn.commit()
+        cursor.execute('SELECT COUNT(*) FROM user_counters')
+        users = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM rating_stats')
+        click.echo(f'Rebuilt counters for {users} users and {cursor.fetchone()[0]} rating aggregates')
+    finally:
+        conn.close()
+
+# Check the schema on startup
+ensure_schema()
+
+# Ensure live_prices upload directory exists
+os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'live_prices'), exist_ok=True)
+
+# ==========================================
+# BROADCAST NOTIFICATIONS
+# ==========================================
+
+# Newest items returned by /api/notifications
+NOTIFICATION_FEED_LIMIT = 200
+
+def publish_announcement(cursor, category, title, message, related_item_id=None, related_item_type=None, exclude_user_id=None):
+    """Notify every user with a single row; feeds are resolved at read time"""
+    cursor.execute('''
+        INSERT INTO announcements (category, title, message, related_item_id, related_item_type, exclude_user_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (category, title, message, related_item_id, related_item_type, exclude_user_id))
+    return cursor.lastrowid
+
+def get_notification_cursor(cursor, user_id):
+    """(registered_at, read_through_id) - users only see announcements from after they joined"""
+    cursor.execute('''
+        SELECT u.created_at, COALESCE(c.read_through_id, 0) as read_through_id
+        FROM users u
+        LEFT JOIN notification_cursors c ON c.user_id = u.id
+        WHERE u.id = ?
+    ''', (user_id,))
+    row = cursor.fetchone()
+    if not row:
+        return '', 0
+    return row['created_at'] or '', row['read_through_id']
+
+def count_unread_notifications(cursor, user_id):
+    """(unread count, last event_log id it accounts for), read in one statement"""
+    registered_at, read_through_id = get_notification_cursor(cursor, user_id)
+    
+    # Only broadcasts past the read cursor can be unread
+    cursor.execute('''
+        SELECT (
+            SELECT COUNT(*) FROM notifications
+            WHERE user_id = ? AND is_read = 0
+        ) + (
+            SELECT COUNT(*) FROM announcements a
+            WHERE a.id > ?
+              AND a.created_at >= ?
+              AND (a.exclude_user_id IS NULL OR a.exclude_user_id != ?)
+              AND NOT EXISTS (
+                  SELECT 1 FROM announcement_reads ar
+                  WHERE ar.user_id = ? AND ar.announcement_id = a.id
+              )
+        ) as count,
+        (SELECT COALESCE(MAX(id), 0) FROM event_log) as event_id
+    ''', (user_id, read_through_id, registered_at, user_id, user_id))
+    row = cursor.fetchone()
+    return row['count'], row['event_id']
+
+# ==========================================
+# NOTIFICATION OUTBOX & FAN-OUT WORKER
+# ==========================================
+# Handlers only append an outbox row inside their own transaction; a
+# background worker turns it into an announcement (audience "all") or into
+# per-user notifications rows written in executemany batches.
+
+NOTIFICATION_BATCH_SIZE = int(os.getenv('NOTIFICATION_BATCH_SIZE', '500'))
+NOTIFICATION_POLL_INTERVAL = 1.0   # seconds between outbox polls when idle
+NOTIFICATION_MAX_ATTEMPTS = 5      # non-lock failures before a job is marked failed
+
+def enqueue_notification(cursor, audience, category, title, message, related_item_id=None, related_item_type=None):
+    """Queue a notification for fan-out; commit, then call fanout_worker.wake()
+
+    audience is {'all': True, 'exclude_user_id': id} for a broadcast or
+    {'user_ids': [...]} for individual recipients.
+    """
+    cursor.execute('''
+        INSERT INTO notification_outbox (category, title, message, related_item_id, related_item_type, audience)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (category, title, message, related_item_id, related_item_type, json.dumps(audience)))
+    return cursor.lastrowid
+
+def resolve_recipients(cursor, audience, after_user_id, limit):
+    """Next batch of recipient ids (ascending, > after_user_id) for a per-user audience"""
+    exclude_user_id = audience.get('exclude_user_id') or 0
+    terms = audience.get('match')
+    if terms:
+        # Each (kind, value) term is a primary-key range; user_id > ? resumes
+        # after the previous batch so no OFFSET is re-scanned
+        clause = ' OR '.join('(kind = ? AND value = ?)' for _ in terms)
+        params = [p for kind, value in terms for p in (kind, normalize_interest(value))]
+        cursor.execute(f'''
+            SELECT DISTINCT user_id FROM user_interests
+            WHERE ({clause}) AND user_id > ? AND user_id != ?
+            ORDER BY user_id
+            LIMIT ?
+        ''', params + [after_user_id, exclude_user_id, limit])
+        return [row['user_id'] for row in cursor.fetchall()]
+    user_ids = sorted(int(uid) for uid in audience.get('user_ids', [])
+                      if int(uid) > after_user_id and int(uid) != exclude_user_id)
+    return user_ids[:limit]
+
+# ==========================================
+# NOTIFICATION TARGETING
+# ==========================================
+# Posts only notify users whose interest index matches, instead of everyone.
+# NOTIFICATION_TARGETING=0 restores the broadcast-to-all behaviour.
+
+NOTIFICATION_TARGETING = os.getenv('NOTIFICATION_TARGETING', '1') == '1'
+
+def normalize_interest(value):
+    return (value or '').strip().lower()
+
+def target_audience(category, exclude_user_id=None, **attributes):
+    """Audience spec for a post's notification based on what was posted"""
+    if not NOTIFICATION_TARGETING:
+        return {'all': True, 'exclude_user_id': exclude_user_id}
+    
+    if category == 'product_posted':
+        # Buyers who looked at, saved or asked for this product or category
+        terms = [('product', attributes.get('product')), ('product_category', attributes.get('product_category'))]
+    elif category == 'product_requirement_posted':
+        # Farmers who sell what the customer needs
+        terms = [('sells', attributes.get('product'))]
+    elif category == 'rental_posted':
+        # Farmers who asked for or browsed this kind of equipment
+        terms = [('rental', attributes.get('rental_category'))]
+    elif category == 'rental_requirement_posted':
+        # Neighbours in the same district; owners of that equipment if no district given
+        if normalize_interest(attributes.get('district')):
+            terms = [('district', attributes.get('district'))]
+        else:
+            terms = [('rents_out', attributes.get('rental_category'))]
+    else:
+        return {'all': True, 'exclude_user_id': exclude_user_id}
+    
+    terms = [[kind, normalize_interest(value)] for kind, value in terms if normalize_interest(value)]
+    return {'match': terms, 'exclude_user_id': exclude_user_id}
+
+@app.cli.command('rebuild-interests')
+def rebuild_interests_command():
+    """Recompute the notification interest index from source tables"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        rebuild_user_interests(cursor)
+        conn.commit()
+        cursor.execute('SELECT COUNT(*) FROM user_interests')
+        click.echo(f'Rebuilt {cursor.fetchone()[0]} interest entries')
+    finally:
+        conn.close()
+
+def is_lock_error(error):
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error).lower()
+
+class NotificationFanoutWorker:
+    """Drains notification_outbox in the background, one batch per transaction"""
+
+    def __init__(self, batch_size, poll_interval):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.rows_written = 0
+        self.batches = 0
+        self.lock_retries = 0
+        self.last_lag_seconds = None
+
+    def ensure_started(self):
+        """Start the thread in this process (once per gunicorn worker)"""
+        if self.pid == os.getpid() and self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread is not None and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name='notification-fanout', daemon=True)
+            self.thread.start()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def run(self):
+        backoff = 0.05
+        while True:
+            try:
+                busy = self.process_next()
+                backoff = 0.05
+            except sqlite3.OperationalError as e:
+                if not is_lock_error(e):
+                    print(f"Notification fan-out error: {e}")
+                with self.lock:
+                    self.lock_retries += 1
+                # Jittered exponential backoff while another writer holds the lock
+                time.sleep(backoff + random.uniform(0, backoff))
+                backoff = min(backoff * 2, 2.0)
+                continue
+            except Exception as e:
+                print(f"Notification fan-out error: {e}")
+                busy = False
+            if not busy:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+
+    def process_next(self):
+        """Write one batch of the oldest pending job; False when the outbox is empty"""
+        conn = db_pool.acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM notification_outbox WHERE status = 'pending' ORDER BY id LIMIT 1")
+            row = cursor.fetchone()
+            if not row:
+                return False
+            try:
+                self.process_batch(conn, row['id'])
+            except sqlite3.OperationalError as e:
+                if is_lock_error(e):
+                    raise
+                self.record_failure(conn, row['id'], e)
+            except Exception as e:
+                self.record_failure(conn, row['id'], e)
+            return True
+        finally:
+            conn.close()
+
+    def process_batch(self, conn, job_id):
+        # The cursor is re-read under the write lock, so several workers can
+        # drain the same job without ever writing a recipient twice
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.cursor()
             cursor.execute('''
-                CREATE TABLE live_price_feedback (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    price_id INTEGER NOT NULL,
-                    user_id INTEGER,
-                    farmer_name TEXT,
-                    rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
-                    comment TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (price_id) REFERENCES live_prices (id),
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
+                SELECT *, (julianday('now') - julianday(created_at)) * 86400 as lag_seconds
+                FROM notification_outbox WHERE id = ? AND status = 'pending'
+            ''', (job_id,))
+            job = cursor.fetchone()
+            if not job:
+                conn.commit()
+                return
+            
+            audience = json.loads(job['audience'])
+            finished = True
+            written = 0
+            if audience.get('all'):
+                publish_announcement(cursor, job['category'], job['title'], job['message'],
+                                     job['related_item_id'], job['related_item_type'],
+                                     exclude_user_id=audience.get('exclude_user_id'))
+                written = 1
+            else:
+                recipients = resolve_recipients(cursor, audience, job['cursor_user_id'], self.batch_size)
+                if recipients:
+                    last_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM notifications').fetchone()[0]
+                    cursor.executemany('''
+                        INSERT INTO notifications (user_id, category, title, message, related_item_id, related_item_type)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', [(user_id, job['category'], job['title'], job['message'],
+                           job['related_item_id'], job['related_item_type']) for user_id in recipients])
+                    # One push event for the whole batch, mapping each recipient to their row id
+                    cursor.execute('''
+                        INSERT INTO event_log (channel, event, payload)
+                        SELECT 'notifications', 'notification', json_object(
+                            'kind', 'notification', 'category', ?, 'title', ?, 'message', ?,
+                            'related_item_id', ?, 'related_item_type', ?,
+                            'is_read', json('false'), 'created_at', MAX(created_at),
+                            'recipients', json_group_object(user_id, id)
+                        )
+                        FROM notifications WHERE id > ?
+                    ''', (job['category'], job['title'], job['message'],
+                          job['related_item_id'], job['related_item_type'], last_id))
+                    written = len(recipients)
+                    cursor.execute('''
+                        UPDATE notification_outbox
+                        SET cursor_user_id = ?, delivered_count = delivered_count + ?
+                        WHERE id = ?
+                    ''', (recipients[-1], written, job_id))
+                finished = len(recipients) < self.batch_size
+            
+            if finished:
+                cursor.execute('''
+                    UPDATE notification_outbox
+                    SET status = 'done', processed_at = CURRENT_TIMESTAMP, delivered_count = delivered_count + ?
+                    WHERE id = ?
+                ''', (written if audience.get('all') else 0, job_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        with self.lock:
+            self.batches += 1
+            self.rows_written += written
+            if finished:
+                self.jobs_done += 1
+                self.last_lag_seconds = round(job['lag_seconds'], 3)
+
+    def record_failure(self, conn, job_id, error):
+        print(f"Notification fan-out job {job_id} failed: {error}")
+        conn.execute('''
+            UPDATE notification_outbox
+            SET attempts = attempts + 1,
+                last_error = ?,
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+            WHERE id = ?
+        ''', (str(error), NOTIFICATION_MAX_ATTEMPTS, job_id))
+        conn.commit()
+        with self.lock:
+            self.jobs_failed += 1
+
+    def stats(self):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*) as depth,
+                       COALESCE((julianday('now') - julianday(MIN(created_at))) * 86400, 0) as oldest_age
+                FROM notification_outbox WHERE status = 'pending'
             ''')
-            print("Migration completed.")
-    except Exception as e:
-        print(f"Migration check: {e}")
-        pass
+            pending = cursor.fetchone()
+        finally:
+            conn.close()
+        with self.lock:
+            return {
+                'queue_depth': pending['depth'],
+                'fanout_lag_seconds': round(pending['oldest_age'], 3),
+                'last_job_lag_seconds': self.last_lag_seconds,
+                'jobs_done': self.jobs_done,
+                'jobs_failed': self.jobs_failed,
+                'batches': self.batches,
+                'rows_written': self.rows_written,
+                'lock_retries': self.lock_retries,
+                'running': self.thread is not None and self.thread.is_alive() and self.pid == os.getpid()
+            }
+
+fanout_worker = NotificationFanoutWorker(NOTIFICATION_BATCH_SIZE, NOTIFICATION_POLL_INTERVAL)
+register_metrics('notification_fanout', fanout_worker.stats)
+
+@app.before_request
+def start_background_workers():
+    # Started lazily so each forked gunicorn worker gets its own thread;
+    # set NOTIFICATION_WORKER=0 when running 'flask notification-worker' separately
+    if os.getenv('NOTIFICATION_WORKER', '1') == '1':
+        fanout_worker.ensure_started()
+
+@app.cli.command('notification-worker')
+def notification_worker_command():
+    """Run the notification fan-out worker in the foreground"""
+    click.echo('Notification fan-out worker running (Ctrl+C to stop)')
+    fanout_worker.pid = os.getpid()
+    fanout_worker.run()
+
+# ==========================================
+# PUSH EVENTS (SSE)
+# ==========================================
+# Triggers append changes to event_log. Each worker runs one hub thread that
+# tails event_log by id and hands new rows to the streams connected to that
+# worker, so the cost is one indexed query per poll, not one per client.
+# Clients resume with Last-Event-ID; older gaps fall back to a 'reset' event.
+# Per-user events (read-state changes) carry event_log.user_id, so a
+# reconnecting user only replays shared events and their own; the fan-out
+# worker logs one 'notification' event per batch with a recipients map.
+# Streams hold a worker thread for EVENT_STREAM_MAX_SECONDS: gunicorn.conf.py
+# runs gthread workers with a timeout above that.
+
+EVENT_POLL_INTERVAL = float(os.getenv('EVENT_POLL_INTERVAL', '0.5'))
+EVENT_HEARTBEAT_SECONDS = 15
+EVENT_STREAM_MAX_SECONDS = int(os.getenv('EVENT_STREAM_MAX_SECONDS', '300'))
+EVENT_RETRY_MS = 3000
+EVENT_REPLAY_LIMIT = 500
+EVENT_QUEUE_SIZE = 1000
+EVENT_RETENTION = '-2 days'
+EVENT_MAINTENANCE_INTERVAL = 30
+# Well below gunicorn's default 30 s worker timeout, which kills a sync
+# worker still holding a long-poll
+LONG_POLL_SECONDS = float(os.getenv('LONG_POLL_SECONDS', '10'))
+
+class EventSubscription:
+    """One connected stream: the channels it wants and a bounded queue"""
+    
+    def __init__(self, channels, predicate=None):
+        self.channels = frozenset(channels)
+        self.predicate = predicate
+        self.queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.overflowed = False
+    
+    def offer(self, event):
+        if event['channel'] not in self.channels or (self.predicate and not self.predicate(event)):
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            # A stalled client; its stream ends and it resumes from the log
+            self.overflowed = True
+            return False
+
+def decode_event(row):
+    return {
+        'id': row['id'],
+        'channel': row['channel'],
+        'event': row['event'],
+        'data': json.loads(row['payload'] or '{}')
+    }
+
+class EventHub:
+    """Per-worker tail of event_log fanned out to in-process subscriptions"""
+    
+    def __init__(self, poll_interval):
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.thread = None
+        self.pid = None
+        self.last_id = None
+        self.last_maintenance = 0.0
+        self.polls = 0
+        self.events_read = 0
+        self.events_delivered = 0
+        self.expired_posts = 0
+    
+    def ensure_started(self):
+        """Start the tail thread in this process (once per gunicorn worker)"""
+        with self.lock:
+            if self.pid == os.getpid() and self.thread is not None and self.thread.is_alive():
+                return
+            if self.pid != os.getpid():
+                self.subscriptions = set()
+                self.last_id = None
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name='event-hub', daemon=True)
+            self.thread.start()
+    
+    def subscribe(self, channels, predicate=None):
+        """Register before the caller reads its snapshot, so later commits reach the queue"""
+        self.ensure_started()
+        subscription = EventSubscription(channels, predicate)
+        with self.lock:
+            if self.last_id is None:
+                # Pin the tail position now; pinning on the hub's next poll
+                # would skip events committed after the caller's snapshot
+                conn = db_pool.acquire()
+                try:
+                    self.last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM event_log').fetchone()[0]
+                finally:
+                    conn.close()
+            self.subscriptions.add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+    
+    def run(self):
+        while True:
+            try:
+                self.poll_once()
+            except sqlite3.OperationalError as e:
+                if not is_lock_error(e):
+                    print(f"Event hub error: {e}")
+            except Exception as e:
+                print(f"Event hub error: {e}")
+            time.sleep(self.poll_interval)
+    
+    def poll_once(self):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+            if not subscriptions:
+                # Nobody listening: the next subscribe pins a fresh position
+                self.last_id = None
+                return
+        conn = db_pool.acquire()
+        try:
+            if self.last_id is None:
+                self.last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM event_log').fetchone()[0]
+            if time.monotonic() - self.last_maintenance >= EVENT_MAINTENANCE_INTERVAL:
+                self.last_maintenance = time.monotonic()
+                self.maintain(conn, subscriptions)
+            rows = conn.execute('''
+                SELECT id, channel, event, payload FROM event_log
+                WHERE id > ? ORDER BY id LIMIT 500
+            ''', (self.last_id,)).fetchall()
+            self.polls += 1
+            for row in rows:
+                event = decode_event(row)
+                self.last_id = event['id']
+                self.events_read += 1
+                for subscription in subscriptions:
+                    if subscription.offer(event):
+                        self.events_delivered += 1
+        finally:
+            conn.close()
+    
+    def maintain(self, conn, subscriptions):
+        """Log expiries of live prices (nothing writes when a post ages out) and prune"""
+        if any('live_prices' in subscription.channels for subscription in subscriptions):
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO event_log (channel, event, ref_id, payload)
+                SELECT 'live_prices', 'price_expired', id,
+                       json_object('id', id, 'state', state, 'district', district, 'category', category)
+                FROM live_prices
+                WHERE created_at < datetime('now', '-24 hours')
+                  AND created_at >= datetime('now', '-25 hours')
+            ''')
+            self.expired_posts += max(cursor.rowcount, 0)
+        conn.execute("DELETE FROM event_log WHERE created_at < datetime('now', ?)", (EVENT_RETENTION,))
+        conn.commit()
+    
+    def replay(self, channels, after_id, predicate=None, user_id=None):
+        """Logged events after after_id; None if the log no longer reaches back that far
+
+        With user_id, other users' personal events are skipped in SQL, so
+        they don't count toward EVENT_REPLAY_LIMIT.
+        """
+        conn = db_pool.acquire()
+        try:
+            oldest = conn.execute('SELECT MIN(id) FROM event_log').fetchone()[0]
+            if oldest is not None and oldest > after_id + 1:
+                return None
+            placeholders = ', '.join('?' for _ in channels)
+            if user_id is None:
+                rows = conn.execute(f'''
+                    SELECT id, channel, event, payload FROM event_log
+                    WHERE channel IN ({placeholders}) AND id > ?
+                    ORDER BY id LIMIT ?
+                ''', list(channels) + [after_id, EVENT_REPLAY_LIMIT + 1]).fetchall()
+            else:
+                # Shared events (user_id NULL) and this user's, each an index range
+                rows = conn.execute(f'''
+                    SELECT id, channel, event, payload FROM event_log
+                    WHERE channel IN ({placeholders}) AND user_id IS NULL AND id > ?
+                    UNION ALL
+                    SELECT id, channel, event, payload FROM event_log
+                    WHERE channel IN ({placeholders}) AND user_id = ? AND id > ?
+                    ORDER BY id LIMIT ?
+                ''', list(channels) + [after_id] + list(channels) + [user_id, after_id, EVENT_REPLAY_LIMIT + 1]).fetchall()
+        finally:
+            conn.close()
+        if len(rows) > EVENT_REPLAY_LIMIT:
+            return None
+        events = [decode_event(row) for row in rows]
+        return [event for event in events if not predicate or predicate(event)]
+    
+    def stats(self):
+        with self.lock:
+            subscribers = len(self.subscriptions)
+        return {
+            'subscribers': subscribers,
+            'last_event_id': self.last_id,
+            'polls': self.polls,
+            'events_read': self.events_read,
+            'events_delivered': self.events_delivered,
+            'expired_posts': self.expired_posts,
+            'running': self.thread is not None and self.thread.is_alive() and self.pid == os.getpid()
+        }
+
+event_hub = EventHub(EVENT_POLL_INTERVAL)
+register_metrics('event_hub', event_hub.stats)
+
+def sse_message(event_id, event, data):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event}', f'data: {json.dumps(data)}']
+    return '\n'.join(lines) + '\n\n'
+
+def parse_last_event_id():
+    """Resume point from the Last-Event-ID header (or ?last_event_id=)"""
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+def default_render(event):
+    return [sse_message(event['id'], event['event'], event['data'])]
+
+def event_stream(channels, predicate=None, last_event_id=None, initial=None, render=default_render, user_id=None):
+    """text/event-stream response: initial state, optional replay, then live events and heartbeats"""
+    subscription = event_hub.subscribe(channels, predicate)
+    
+    def generate():
+        try:
+            yield f'retry: {EVENT_RETRY_MS}\n\n'
+            for message in (initial() if initial else []):
+                yield message
+            sent = last_event_id or 0
+            if last_event_id is not None:
+                missed = event_hub.replay(channels, last_event_id, predicate, user_id)
+                if missed is None:
+                    # Too far behind: the client reloads its snapshot instead
+                    yield sse_message(None, 'reset', {})
+                else:
+                    for event in missed:
+                        sent = event['id']
+                        yield from render(event)
+            deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+            while time.monotonic() < deadline and not subscription.overflowed:
+                try:
+                    event = subscription.queue.get(timeout=min(EVENT_HEARTBEAT_SECONDS, max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if event['id'] <= sent:
+                    continue
+                sent = event['id']
+                yield from render(event)
+        finally:
+            event_hub.unsubscribe(subscription)
+    
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def wait_for_events(channels, predicate, after_id, timeout, user_id=None):
+    """Long-poll: events after after_id, waiting up to timeout for the first; None to reset"""
+    subscription = event_hub.subscribe(channels, predicate)
+    try:
+        missed = event_hub.replay(channels, after_id, predicate, user_id)
+        if missed is None or missed:
+            return missed
+        events = []
+        try:
+            events.append(subscription.queue.get(timeout=timeout))
+            while True:
+                events.append(subscription.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return [event for event in events if event['id'] > after_id]
+    finally:
+        event_hub.unsubscribe(subscription)
+
+# ==========================================
+# RESPONSE CACHE
+# ==========================================
+# Serialized JSON of the public listings, keyed by route + query string and
+# tagged with the collections it renders. Write handlers invalidate by tag;
+# entries are also bound to the ETag they were built for, so a version bump
+# from another process never serves an old body under a new tag.
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '256'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '60'))
+
+class ResponseCache:
+    """Size-bounded LRU of response bodies with TTL and tag invalidation"""
+    
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.route_stats = {}
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def _count(self, route, outcome):
+        counts = self.route_stats.setdefault(route, {'hits': 0, 'misses': 0})
+        counts[outcome] += 1
+    
+    def get(self, route, key, etag):
+        """Cached (body, mimetype) for key if still fresh and built for this etag"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry['etag'] == etag and entry['expires'] > time.monotonic():
+                self.entries.move_to_end(key)
+                self._count(route, 'hits')
+                return entry['body'], entry['mimetype']
+            if entry:
+                del self.entries[key]
+            self._count(route, 'misses')
+            return None
+    
+    def put(self, key, tags, etag, body, mimetype):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = {
+                'tags': frozenset(tags),
+                'etag': etag,
+                'body': body,
+                'mimetype': mimetype,
+                'encoded': {},
+                'expires': time.monotonic() + self.ttl
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+    
+    def encoded(self, key, etag, encoding, build):
+        """Compressed body for a cached entry, built at most once per encoding"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry['etag'] == etag and encoding in entry['encoded']:
+                return entry['encoded'][encoding], True
+        data = build()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry['etag'] == etag:
+                entry['encoded'][encoding] = data
+        return data, False
+    
+    def invalidate(self, *tags):
+        """Drop every entry rendering any of the given collections"""
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if entry['tags'] & set(tags)]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+    
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+    
+    def stats(self):
+        with self.lock:
+            routes = {}
+            for route, counts in self.route_stats.items():
+                total = counts['hits'] + counts['misses']
+                routes[route] = dict(counts, hit_ratio=round(counts['hits'] / total, 3) if total else 0.0)
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'routes': routes
+            }
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+register_metrics('response_cache', response_cache.stats)
+
+# ==========================================
+# CROSS-WORKER CACHE COHERENCE
+# ==========================================
+# Each gunicorn worker keeps its own caches. A private connection per worker
+# watches PRAGMA data_version, which moves whenever any other connection (a
+# sibling worker, a CLI command, this worker's pool) commits. When it moves,
+# collection_versions says which collections changed and subscribers drop
+# their entries. Polled from before_request at most every
+# CACHE_COHERENCE_INTERVAL seconds, which bounds how long a stale entry lives.
+
+CACHE_COHERENCE_INTERVAL = float(os.getenv('CACHE_COHERENCE_INTERVAL', '0.5'))
+
+class CacheCoherenceBus:
+    """Detects commits from other connections and fans out changed collections"""
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.pid = None
+        self.database = None
+        self.conn = None
+        self.data_version = None
+        self.versions = {}
+        self.last_poll = 0.0
+        self.polls = 0
+        self.changes = 0
+    
+    def subscribe(self, listener):
+        """listener(changed_collections) is called after another connection commits"""
+        self.listeners.append(listener)
+    
+    def _reset(self):
+        # Never share (or close) the parent's handle across a fork
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+        self.pid = os.getpid()
+        self.database = db_pool.database
+        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        self.conn.execute('PRAGMA busy_timeout = 5000')
+        self.data_version = None
+        self.versions = self._read_versions()
+    
+    def _read_versions(self):
+        try:
+            return dict(self.conn.execute('SELECT collection, version FROM collection_versions').fetchall())
+        except sqlite3.OperationalError:
+            # Schema not migrated yet
+            return {}
+    
+    def poll(self, force=False):
+        """Check for outside writes; returns the set of collections that changed"""
+        now = time.monotonic()
+        if not force and now - self.last_poll < self.interval:
+            return set()
+        with self.lock:
+            if self.pid != os.getpid() or self.database != db_pool.database:
+                self._reset()
+            self.last_poll = now
+            self.polls += 1
+            data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self.data_version:
+                return set()
+            self.data_version = data_version
+            versions = self._read_versions()
+            changed = {name for name, version in versions.items() if self.versions.get(name) != version}
+            self.versions = versions
+            self.changes += len(changed)
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
+        return changed
+    
+    def stats(self):
+        return {
+            'interval_seconds': self.interval,
+            'polls': self.polls,
+            'collections_changed': self.changes,
+            'versions': dict(self.versions)
+        }
+
+coherence_bus = CacheCoherenceBus(CACHE_COHERENCE_INTERVAL)
+coherence_bus.subscribe(lambda changed: response_cache.invalidate(*changed))
+register_metrics('cache_coherence', coherence_bus.stats)
+
+@app.before_request
+def sync_worker_caches():
+    coherence_bus.poll()
+
+# ==========================================
+# CONDITIONAL GET (ETag / Last-Modified)
+# ==========================================
+# Public listings carry a strong ETag built from their collection version and
+# query string; a matching If-None-Match gets a 304 before any row is read.
 
-    conn.commit()
+def collection_state(collections):
+    """(version tuple, last modified datetime) for the given collections"""
+    conn = get_db_connection()
+    placeholders = ', '.join('?' for _ in collections)
+    rows = conn.execute(f'''
+        SELECT collection, version, updated_at FROM collection_versions
+        WHERE collection IN ({placeholders})
+    ''', collections).fetchall()
+    conn.close()
+    found = {row['collection']: row for row in rows}
+    versions = tuple(found[c]['version'] if c in found else 0 for c in collections)
+    stamps = [found[c]['updated_at'] for c in collections if c in found and found[c]['updated_at']]
+    last_modified = datetime.strptime(max(stamps), '%Y-%m-%d %H:%M:%S') if stamps else None
+    return versions, last_modified
+
+def live_prices_window():
+    """Oldest post still inside the 24 hour window; changes when a post expires"""
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT MIN(created_at) FROM live_prices WHERE created_at >= datetime('now', '-24 hours')
+    ''').fetchone()
     conn.close()
+    return row[0] or ''
+
+def versioned_listing(*collections, extra=None):
+    """Decorator adding ETag / Last-Modified validators and response caching to a public GET listing"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            versions, last_modified = collection_state(collections)
+            parts = [f.__name__, *map(str, versions), request.query_string.decode()]
+            if extra:
+                parts.append(extra())
+            etag = hashlib.sha1('|'.join(parts).encode()).hexdigest()[:20]
+            
+            # Weak match: compressed variants carry W/"..." of the same tag
+            if request.if_none_match.contains_weak(etag) or (
+                not request.if_none_match and not extra and last_modified and request.if_modified_since
+                and last_modified <= request.if_modified_since.replace(tzinfo=None)
+            ):
+                response = make_response('', 304)
+            else:
+                key = (f.__name__, request.query_string)
+                cached = response_cache.get(f.__name__, key, etag)
+                if cached:
+                    response = app.response_class(cached[0], mimetype=cached[1])
+                else:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    response_cache.put(key, collections, etag, response.get_data(), response.mimetype)
+            response.set_etag(etag)
+            if response.status_code == 200:
+                compress_cached(response, key, etag)
+            if last_modified:
+                response.last_modified = last_modified
+            # Clients may keep the body but must revalidate before reusing it
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+# ==========================================
+# RESPONSE COMPRESSION
+# ==========================================
+# JSON above COMPRESS_MIN_SIZE is compressed per response (Brotli when the
+# client accepts it and the module is installed, else gzip). Cached listings
+# keep each compressed variant next to the body, so hits skip the encoder.
+# The HTML pages are static, so each worker renders and compresses them once
+# and serves the stored variant that matches Accept-Encoding.
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_MIMETYPES = ('application/json',)
+PRECOMPRESSED_PAGES = ('index.html', 'dashboard.html')
+
+def compress_body(data, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6)
+
+def negotiate_encoding():
+    """Best content coding the client accepts, or None for identity"""
+    offered = ['br', 'gzip'] if brotli else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+compression_stats = {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'reused': 0}
+compression_lock = threading.Lock()
+
+def compression_snapshot():
+    with compression_lock:
+        return dict(compression_stats)
+
+register_metrics('compression', compression_snapshot)
+
+def compressible(response):
+    return not (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES)
+
+def apply_encoding(response, data, encoding, compressed, reused=False):
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # A different byte representation may only share the tag weakly
+    tag, weak = response.get_etag()
+    if tag and not weak:
+        response.set_etag(tag, weak=True)
+    with compression_lock:
+        compression_stats['responses'] += 1
+        compression_stats['bytes_in'] += len(data)
+        compression_stats['bytes_out'] += len(compressed)
+        compression_stats['reused'] += int(reused)
+
+def compress_cached(response, key, etag):
+    """Compress a cached listing once per encoding and reuse it on later hits"""
+    if not compressible(response):
+        return
+    encoding = negotiate_encoding()
+    data = response.get_data()
+    if not encoding or len(data) < COMPRESS_MIN_SIZE:
+        return
+    compressed, reused = response_cache.encoded(key, etag, encoding, lambda: compress_body(data, encoding))
+    apply_encoding(response, data, encoding, compressed, reused)
 
-# Initialize database on startup
-init_db()
+@app.after_request
+def compress_response(response):
+    response.vary.add('Accept-Encoding')
+    if not compressible(response):
+        return response
+    encoding = negotiate_encoding()
+    data = response.get_data()
+    if not encoding or len(data) < COMPRESS_MIN_SIZE:
+        return response
+    apply_encoding(response, data, encoding, compress_body(data, encoding))
+    return response
 
-# Ensure live_prices upload directory exists
-os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'live_prices'), exist_ok=True)
+# ==========================================
+# FINGERPRINTED ASSETS
+# ==========================================
+# 'flask build-assets' moves the inline <style>/<script> blocks of the pages
+# into content-hashed files under static/build: all CSS becomes one bundle
+# linked from <head> (same cascade order), each script becomes its own file
+# loaded at the same place so execution order is unchanged; scripts marked
+# data-section="..." become on-demand modules for the dashboard. The remaining
+# shell is served instead of the template while its source hash still
+# matches; hashed assets are served as immutable for a year, anything else
+# under static/build (manifest, page shells) must be revalidated.
+
+ASSET_BUILD_DIR = os.path.join(app.root_path, 'static', 'build')
+ASSET_URL_PREFIX = '/assets/'
+ASSET_MAX_AGE = 365 * 24 * 3600
+# Names written by asset_name(): label.<12 hex digit content hash>.ext
+HASHED_ASSET_NAME = re.compile(r'^[\w-]+\.[0-9a-f]{12}\.(?:js|css)$')
+INLINE_BLOCK = re.compile(r'<!--.*?-->|<(script|style)\b([^>]*)>(.*?)</\1\s*>', re.S | re.I)
+SCRIPT_TYPES = ('', 'text/javascript', 'application/javascript')
+
+def fingerprint(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+
+def extract_inline_assets(html, stem):
+    """Split a page into (shell, {filename: content}) with inline CSS/JS moved out"""
+    assets = {}
+    styles = []
+    
+    def asset_name(content, label, ext):
+        name = f'{label}.{fingerprint(content)}.{ext}'
+        assets[name] = content
+        return name
+    
+    def replace(match):
+        tag, attrs, content = match.group(1), match.group(2) or '', match.group(3)
+        if not tag or not content.strip():
+            return match.group(0)
+        if tag.lower() == 'style':
+            if 'media=' in attrs.lower():
+                return match.group(0)
+            styles.append(content)
+            # The first block becomes the bundle link, later ones just disappear
+            return '\x00STYLE_BUNDLE\x00' if len(styles) == 1 else ''
+        script_type = re.search(r'type\s*=\s*["\']([^"\']*)', attrs, re.I)
+        if 'src=' in attrs.lower() or (script_type and script_type.group(1).lower() not in SCRIPT_TYPES):
+            return match.group(0)
+        section = re.search(r'data-section\s*=\s*["\']([\w-]+)', attrs, re.I)
+        if section:
+            # Loaded by the dashboard's section loader on first visit to the tab
+            name = asset_name(content, f'{stem}-{section.group(1)}', 'js')
+            return f'<template data-section-module="{section.group(1)}" data-src="{ASSET_URL_PREFIX}{name}"></template>'
+        label = f'{stem}-{sum(name.endswith(".js") for name in assets) + 1:02d}'
+        return f'<script src="{ASSET_URL_PREFIX}{asset_name(content, label, "js")}"></script>'
+    
+    shell = INLINE_BLOCK.sub(replace, html)
+    if styles:
+        bundle = asset_name('\n'.join(styles), stem, 'css')
+        shell = shell.replace('\x00STYLE_BUNDLE\x00', f'<link rel="stylesheet" href="{ASSET_URL_PREFIX}{bundle}" />')
+    return shell, assets
+
+def write_asset(directory, name, content):
+    """Write an asset plus its gzip (and Brotli) variants"""
+    data = content.encode('utf-8')
+    with open(os.path.join(directory, name), 'wb') as f:
+        f.write(data)
+    for encoding, suffix in (('gzip', '.gz'), ('br', '.br')):
+        if encoding == 'br' and not brotli:
+            continue
+        with open(os.path.join(directory, name + suffix), 'wb') as f:
+            f.write(compress_body(data, encoding, best=True))
+
+def load_asset_manifest():
+    try:
+        with open(os.path.join(ASSET_BUILD_DIR, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'pages': {}}
+
+def built_page_shell(template_name):
+    """Built shell for a page, or None if missing or older than the template"""
+    entry = load_asset_manifest()['pages'].get(template_name)
+    if not entry:
+        return None
+    source = app.jinja_env.loader.get_source(app.jinja_env, template_name)[0]
+    if fingerprint(source) != entry['source_hash']:
+        print(f"Warning: {template_name} changed since 'flask build-assets'; serving it unbundled")
+        return None
+    with open(os.path.join(ASSET_BUILD_DIR, entry['shell']), encoding='utf-8') as f:
+        return f.read()
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Move inline CSS/JS of the pages into fingerprinted static files"""
+    os.makedirs(os.path.join(ASSET_BUILD_DIR, 'pages'), exist_ok=True)
+    manifest = {'pages': {}}
+    for template_name in PRECOMPRESSED_PAGES:
+        source = app.jinja_env.loader.get_source(app.jinja_env, template_name)[0]
+        shell, assets = extract_inline_assets(source, template_name.rsplit('.', 1)[0])
+        for name, content in assets.items():
+            write_asset(ASSET_BUILD_DIR, name, content)
+        shell_path = os.path.join('pages', template_name)
+        with open(os.path.join(ASSET_BUILD_DIR, shell_path), 'w', encoding='utf-8') as f:
+            f.write(shell)
+        manifest['pages'][template_name] = {
+            'shell': shell_path,
+            'source_hash': fingerprint(source),
+            'assets': sorted(assets)
+        }
+        click.echo(f'{template_name}: {len(source) // 1024} KB -> {len(shell) // 1024} KB shell + {len(assets)} assets')
+    with open(os.path.join(ASSET_BUILD_DIR, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+@app.route(ASSET_URL_PREFIX + '<path:filename>')
+def built_asset(filename):
+    """Built asset; a fingerprinted name changes with the content, so cache it forever"""
+    hashed = bool(HASHED_ASSET_NAME.match(filename))
+    encoding = negotiate_encoding()
+    variant = filename + {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+    if not encoding or not os.path.isfile(os.path.join(ASSET_BUILD_DIR, variant)):
+        variant, encoding = filename, None
+    response = send_from_directory(ASSET_BUILD_DIR, variant, max_age=ASSET_MAX_AGE if hashed else None,
+                                   mimetype=mimetypes.guess_type(filename)[0])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if hashed:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        # manifest.json and pages/* keep their names across builds
+        response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+class PrecompressedPages:
+    """Rendered pages with gzip/Brotli variants, built once per worker"""
+    
+    def __init__(self):
+        self.pages = {}
+        self.lock = threading.Lock()
+    
+    def build(self, template_name):
+        with app.app_context():
+            shell = built_page_shell(template_name)
+            html = render_template_string(shell) if shell is not None else render_template(template_name)
+            body = html.encode('utf-8')
+        variants = {None: body, 'gzip': compress_body(body, 'gzip', best=True)}
+        if brotli:
+            variants['br'] = compress_body(body, 'br', best=True)
+        with self.lock:
+            self.pages[template_name] = variants
+        return variants
+    
+    def warm(self):
+        for template_name in PRECOMPRESSED_PAGES:
+            try:
+                self.build(template_name)
+            except TemplateNotFound:
+                pass
+    
+    def response(self, template_name):
+        # Re-render on every request while developing so edits show up
+        variants = self.pages.get(template_name)
+        if variants is None or app.debug:
+            variants = self.build(template_name)
+        encoding = negotiate_encoding()
+        response = make_response(variants[encoding])
+        response.mimetype = 'text/html'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+    
+    def stats(self):
+        return {name: {encoding or 'identity': len(body) for encoding, body in variants.items()}
+                for name, variants in self.pages.items()}
+
+precompressed_pages = PrecompressedPages()
+precompressed_pages.warm()
+register_metrics('precompressed_pages', precompressed_pages.stats)
 
 def login_required(f):
     """Decorator to require login for HTML routes (redirects)"""
@@ -485,7 +2423,7 @@ def api_login_required(f):
 @app.route('/')
 def index():
     """Home page"""
-    return render_template('index.html')
+    return precompressed_pages.response('index.html')
 
 @app.route('/dashboard')
 @login_required
@@ -495,7 +2433,7 @@ def dashboard():
     if 'user_id' not in session:
         flash('Please login to access the dashboard', 'error')
         return redirect(url_for('index'))
-    return render_template('dashboard.html')
+    return precompressed_pages.response('dashboard.html')
 
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -714,6 +2652,7 @@ def update_user():
         
         conn.commit()
         conn.close()
+        response_cache.invalidate('products', 'rentals', 'live_prices')
         
         # Update session
         session['user_name'] = name
@@ -808,6 +2747,7 @@ def update_full_profile():
         
         conn.commit()
         conn.close()
+        response_cache.invalidate('products', 'rentals', 'live_prices')
         
         session['user_name'] = name
         session['user_email'] = email
@@ -866,47 +2806,32 @@ def get_profile_stats():
         cursor = conn.cursor()
         user_id = session['user_id']
         
-        # Count products posted
-        cursor.execute('SELECT COUNT(*) FROM products WHERE user_id = ?', (user_id,))
-        products_count = cursor.fetchone()[0]
-        
-        # Count rentals posted
-        cursor.execute('SELECT COUNT(*) FROM rental_items WHERE user_id = ?', (user_id,))
-        rentals_count = cursor.fetchone()[0]
-        
-        # Count product requirements
-        cursor.execute('SELECT COUNT(*) FROM customer_requirements WHERE user_id = ?', (user_id,))
-        product_reqs_count = cursor.fetchone()[0]
-        
-        # Count rental requirements
-        cursor.execute('SELECT COUNT(*) FROM rental_requirements WHERE user_id = ?', (user_id,))
-        rental_reqs_count = cursor.fetchone()[0]
-        
-        # Count contacts made (from history)
-        cursor.execute("SELECT COUNT(*) FROM user_history WHERE user_id = ? AND action_type = 'contacted'", (user_id,))
-        contacts_count = cursor.fetchone()[0]
-        
-        # Count feedback received
-        cursor.execute('SELECT COUNT(*) FROM user_feedback WHERE farmer_id = ?', (user_id,))
-        feedback_count = cursor.fetchone()[0]
-        
-        # Average rating
-        cursor.execute('SELECT COALESCE(AVG(rating), 0) FROM user_feedback WHERE farmer_id = ?', (user_id,))
-        avg_rating = cursor.fetchone()[0]
+        # Trigger-maintained counters and rating totals: primary-key lookups only
+        cursor.execute('''
+            SELECT COALESCE(uc.products_posted, 0) as products_posted,
+                   COALESCE(uc.rentals_posted, 0) as rentals_posted,
+                   COALESCE(uc.product_requirements, 0) as product_requirements,
+                   COALESCE(uc.rental_requirements, 0) as rental_requirements,
+                   COALESCE(uc.contacts_made, 0) as contacts_made,
+                   COALESCE(rs.rating_count, 0) as feedback_received,
+                   COALESCE(rs.rating_sum * 1.0 / rs.rating_count, 0) as average_rating
+            FROM users u
+            LEFT JOIN user_counters uc ON uc.user_id = u.id
+            LEFT JOIN rating_stats rs ON rs.entity_type = 'farmer' AND rs.entity_id = u.id
+            WHERE u.id = ?
+        ''', (user_id,))
+        row = cursor.fetchone()
+        if not row:
+            conn.close()
+            return jsonify({'success': False, 'message': 'User not found'}), 404
+        stats = dict(row)
+        stats['average_rating'] = round(stats['average_rating'], 1)
         
         conn.close()
         
         return jsonify({
             'success': True,
-            'stats': {
-                'products_posted': products_count,
-                'rentals_posted': rentals_count,
-                'product_requirements': product_reqs_count,
-                'rental_requirements': rental_reqs_count,
-                'contacts_made': contacts_count,
-                'feedback_received': feedback_count,
-                'average_rating': round(avg_rating, 1)
-            }
+            'stats': stats
         }), 200
         
     except Exception as e:
@@ -958,12 +2883,11 @@ def get_my_rentals():
         
         cursor.execute('''
             SELECT ri.*, 
-                   COALESCE(AVG(rf.rating), 0) as avg_rating,
-                   COUNT(rf.id) as review_count
+                   COALESCE(rs.rating_sum * 1.0 / rs.rating_count, 0) as avg_rating,
+                   COALESCE(rs.rating_count, 0) as review_count
             FROM rental_items ri
-            LEFT JOIN rental_feedback rf ON ri.id = rf.rental_id
+            LEFT JOIN rating_stats rs ON rs.entity_type = 'rental' AND rs.entity_id = ri.id
             WHERE ri.user_id = ?
-            GROUP BY ri.id
             ORDER BY ri.created_at DESC
         ''', (session['user_id'],))
         rentals = cursor.fetchall()
@@ -1082,8 +3006,7 @@ def get_profile_feedback():
         feedbacks = cursor.fetchall()
         
         # Calculate average
-        cursor.execute('SELECT COALESCE(AVG(rating), 0), COUNT(*) FROM user_feedback WHERE farmer_id = ?', (user_id,))
-        avg_result = cursor.fetchone()
+        avg_result = rating_summary(cursor, 'farmer', user_id)
         
         conn.close()
         
@@ -1144,8 +3067,7 @@ def get_my_feedback():
         feedbacks = cursor.fetchall()
         
         # Calculate average
-        cursor.execute('SELECT COALESCE(AVG(rating), 0), COUNT(*) FROM user_feedback WHERE user_id = ?', (user_id,))
-        avg_result = cursor.fetchone()
+        avg_result = rating_summary(cursor, 'reviewer', user_id)
         
         conn.close()
         
@@ -1339,12 +3261,7 @@ def submit_product_feedback(product_id):
         conn.commit()
         
         # Get updated average rating
-        cursor.execute('''
-            SELECT COALESCE(AVG(rating), 0) as avg_rating, COUNT(*) as review_count
-            FROM user_feedback
-            WHERE product_id = ?
-        ''', (product_id,))
-        rating_info = cursor.fetchone()
+        avg_rating, review_count = rating_summary(cursor, 'product', product_id)
         
         conn.close()
         
@@ -1352,8 +3269,8 @@ def submit_product_feedback(product_id):
             'success': True,
             'message': 'Feedback submitted successfully',
             'feedback_id': feedback_id,
-            'avg_rating': round(rating_info['avg_rating'], 1),
-            'review_count': rating_info['review_count']
+            'avg_rating': round(avg_rating, 1),
+            'review_count': review_count
         }), 201
         
     except Exception as e:
@@ -1384,12 +3301,7 @@ def get_product_feedback(product_id):
         feedbacks = cursor.fetchall()
         
         # Calculate average rating
-        cursor.execute('''
-            SELECT COALESCE(AVG(rating), 0) as avg_rating, COUNT(*) as review_count
-            FROM user_feedback
-            WHERE product_id = ?
-        ''', (product_id,))
-        rating_info = cursor.fetchone()
+        avg_rating, review_count = rating_summary(cursor, 'product', product_id)
         
         conn.close()
         
@@ -1419,8 +3331,8 @@ def get_product_feedback(product_id):
         return jsonify({
             'success': True,
             'product_name': product['name'],
-            'avg_rating': round(rating_info['avg_rating'], 1),
-            'review_count': rating_info['review_count'],
+            'avg_rating': round(avg_rating, 1),
+            'review_count': review_count,
             'feedbacks': feedback_list
         }), 200
         
@@ -1455,23 +3367,17 @@ def post_rental_requirement():
         ''', (user_id, farmer_name, phone_number, rental_category, field_area, village, mandal, district))
         
         req_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
         
-        # Create notification for all users
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM users')
-        users = cursor.fetchall()
+        # Notify interested users
         location_str = f"{village}, {mandal}, {district}" if village and mandal and district else (district or village or '')
-        for user in users:
-            cursor.execute('''
-                INSERT INTO notifications (user_id, category, title, message, related_item_id, related_item_type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user['id'], 'rental_requirement_posted', 'New Rental Requirement', 
-                  f'{farmer_name} needs {rental_category} rental in {location_str}', req_id, 'rental_requirement'))
+        audience = target_audience('rental_requirement_posted', exclude_user_id=user_id,
+                                   district=district, rental_category=rental_category)
+        enqueue_notification(cursor, audience, 'rental_requirement_posted', 'New Rental Requirement',
+                             f'{farmer_name} needs {rental_category} rental in {location_str}', req_id, 'rental_requirement')
         conn.commit()
         conn.close()
+        response_cache.invalidate('rental_requirements')
+        fanout_worker.wake()
         
         return jsonify({
             'success': True,
@@ -1483,6 +3389,7 @@ def post_rental_requirement():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/rental-requirements', methods=['GET'])
+@versioned_listing('rental_requirements')
 def get_rental_requirements():
     """Get all rental requirements"""
     try:
@@ -1544,21 +3451,73 @@ def contact():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+PRODUCTS_PAGE_SIZE = int(os.getenv('PRODUCTS_PAGE_SIZE', '24'))
+PRODUCTS_MAX_PAGE_SIZE = int(os.getenv('PRODUCTS_MAX_PAGE_SIZE', '100'))
+
+def encode_cursor(*values):
+    """Opaque pagination cursor for a keyset position"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Keyset position from a cursor, None for the first page"""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('Invalid cursor')
+    return values
+
 @app.route('/api/products', methods=['GET'])
+@versioned_listing('products')
 def get_products():
-    """Get all products"""
+    """Get one page of products, newest first, optionally filtered by q and category"""
     try:
+        limit = request.args.get('limit', PRODUCTS_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, PRODUCTS_MAX_PAGE_SIZE))
+        try:
+            after = decode_cursor(request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+        
+        search = request.args.get('q', '').strip().lower()
+        category = request.args.get('category', '').strip().lower()
+        
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('''
+        # Keyset on (created_at, id): the next page starts strictly after the last row seen
+        clauses = []
+        params = []
+        if after:
+            clauses.append('(p.created_at < ? OR (p.created_at = ? AND p.id < ?))')
+            params += [after[0], after[0], after[1]]
+        # Filters apply before the LIMIT so every page is full of matches
+        if category:
+            clauses.append('lower(p.category) = ?')
+            params.append(category)
+        if search:
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            clauses.append("(lower(p.name) LIKE ? ESCAPE '\\' OR lower(u.name) LIKE ? ESCAPE '\\' "
+                           "OR lower(p.category) LIKE ? ESCAPE '\\' OR lower(u.location) LIKE ? ESCAPE '\\')")
+            params += [pattern] * 4
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        cursor.execute(f'''
             SELECT p.*, u.name as farmer_name, u.location as farmer_location
             FROM products p
             JOIN users u ON p.user_id = u.id
-            ORDER BY p.created_at DESC
-        ''')
+            {where}
+            ORDER BY p.created_at DESC, p.id DESC
+            LIMIT ?
+        ''', params + [limit + 1])
         products = cursor.fetchall()
         conn.close()
         
+        has_more = len(products) > limit
+        products = products[:limit]
+        next_cursor = encode_cursor(products[-1]['created_at'], products[-1]['id']) if has_more else None
+        
         products_list = []
         for product in products:
             images = json.loads(product['images']) if product['images'] else []
@@ -1577,7 +3536,12 @@ def get_products():
                 'created_at': product['created_at']
             })
         
-        return jsonify({'success': True, 'products': products_list}), 200
+        return jsonify({
+            'success': True,
+            'products': products_list,
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }), 200
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -1611,32 +3575,22 @@ def create_product():
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (session['user_id'], category, name, description, quantity, unit, price, json.dumps(images)))
         product_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
         
         # Create transaction record
-        conn = get_db_connection()
-        cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO transactions (user_id, type, description, amount)
             VALUES (?, ?, ?, ?)
         ''', (session['user_id'], 'product_created', f'Created product: {name}', 0))
-        conn.commit()
-        conn.close()
         
-        # Create notification for all users (except the creator)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM users WHERE id != ?', (session['user_id'],))
-        users = cursor.fetchall()
-        for user in users:
-            cursor.execute('''
-                INSERT INTO notifications (user_id, category, title, message, related_item_id, related_item_type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user['id'], 'product_posted', 'New Product Available', 
-                  f'{name} ({category}) has been posted', product_id, 'product'))
+        # Notify interested users (except the creator)
+        audience = target_audience('product_posted', exclude_user_id=session['user_id'],
+                                   product=name, product_category=category)
+        enqueue_notification(cursor, audience, 'product_posted', 'New Product Available',
+                             f'{name} ({category}) has been posted', product_id, 'product')
         conn.commit()
         conn.close()
+        response_cache.invalidate('products')
+        fanout_worker.wake()
         
         return jsonify({'success': True, 'message': 'Product created successfully'}), 201
         
@@ -1666,6 +3620,7 @@ def delete_product(product_id):
         cursor.execute('DELETE FROM products WHERE id = ?', (product_id,))
         conn.commit()
         conn.close()
+        response_cache.invalidate('products')
         
         return jsonify({'success': True, 'message': 'Product deleted successfully'}), 200
         
@@ -1673,6 +3628,7 @@ def delete_product(product_id):
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/requirements', methods=['GET'])
+@versioned_listing('requirements')
 def get_requirements():
     """Get all customer requirements"""
     try:
@@ -1728,22 +3684,16 @@ def create_requirement():
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (customer_name, product_name, quantity, location, phone_number, pin_code, special_instructions, preferred_delivery_date))
         req_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
         
-        # Create notification for all users
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM users')
-        users = cursor.fetchall()
-        for user in users:
-            cursor.execute('''
-                INSERT INTO notifications (user_id, category, title, message, related_item_id, related_item_type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user['id'], 'product_requirement_posted', 'New Product Requirement', 
-                  f'{customer_name} needs {quantity} of {product_name} in {location}', req_id, 'product_requirement'))
+        # Notify interested users
+        audience = target_audience('product_requirement_posted', exclude_user_id=session.get('user_id'),
+                                   product=product_name)
+        enqueue_notification(cursor, audience, 'product_requirement_posted', 'New Product Requirement',
+                             f'{customer_name} needs {quantity} of {product_name} in {location}', req_id, 'product_requirement')
         conn.commit()
         conn.close()
+        response_cache.invalidate('requirements')
+        fanout_worker.wake()
         
         return jsonify({'success': True, 'message': 'Requirement posted successfully'}), 201
         
@@ -1784,25 +3734,46 @@ def get_transactions():
 @app.route('/api/notifications', methods=['GET'])
 @api_login_required
 def get_notifications():
-    """Get all notifications for the current user"""
+    """Get notifications for the current user (personal rows merged with broadcasts)"""
     try:
         category = request.args.get('category', None)
+        user_id = session['user_id']
         
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        registered_at, read_through_id = get_notification_cursor(cursor, user_id)
+        
+        personal_filter = broadcast_filter = ''
+        personal_params = [user_id]
+        broadcast_params = [read_through_id, user_id, registered_at, user_id]
         if category and category != 'all':
-            cursor.execute('''
-                SELECT * FROM notifications
-                WHERE user_id = ? AND category = ?
-                ORDER BY created_at DESC
-            ''', (session['user_id'], category))
-        else:
-            cursor.execute('''
-                SELECT * FROM notifications
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-            ''', (session['user_id'],))
+            personal_filter = 'AND category = ?'
+            broadcast_filter = 'AND a.category = ?'
+            personal_params.append(category)
+            broadcast_params.append(category)
+        
+        cursor.execute(f'''
+            SELECT * FROM (
+                SELECT id, 'notification' as kind, category, title, message,
+                       related_item_id, related_item_type, is_read, created_at
+                FROM notifications
+                WHERE user_id = ? {personal_filter}
+                UNION ALL
+                SELECT a.id, 'announcement' as kind, a.category, a.title, a.message,
+                       a.related_item_id, a.related_item_type,
+                       CASE WHEN a.id <= ? OR ar.is_read = 1 THEN 1 ELSE 0 END as is_read,
+                       a.created_at
+                FROM announcements a
+                LEFT JOIN announcement_reads ar ON ar.user_id = ? AND ar.announcement_id = a.id
+                WHERE a.created_at >= ?
+                  AND (a.exclude_user_id IS NULL OR a.exclude_user_id != ?)
+                  AND COALESCE(ar.is_deleted, 0) = 0
+                  {broadcast_filter}
+            )
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', personal_params + broadcast_params + [NOTIFICATION_FEED_LIMIT])
         
         notifications = cursor.fetchall()
         conn.close()
@@ -1811,6 +3782,7 @@ def get_notifications():
         for notif in notifications:
             notifications_list.append({
                 'id': notif['id'],
+                'kind': notif['kind'],
                 'category': notif['category'],
                 'title': notif['title'],
                 'message': notif['message'],
@@ -1861,12 +3833,28 @@ def mark_notification_read(notification_id):
 def mark_all_notifications_read():
     """Mark all notifications as read for the current user"""
     try:
+        user_id = session['user_id']
         conn = get_db_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
             UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0
-        ''', (session['user_id'],))
+        ''', (user_id,))
+        
+        # Broadcasts: advance the cursor and drop per-item read rows it now covers
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM announcements')
+        latest_id = cursor.fetchone()[0]
+        cursor.execute('''
+            INSERT INTO notification_cursors (user_id, read_through_id, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                read_through_id = MAX(read_through_id, excluded.read_through_id),
+                updated_at = excluded.updated_at
+        ''', (user_id, latest_id))
+        cursor.execute('''
+            DELETE FROM announcement_reads
+            WHERE user_id = ? AND announcement_id <= ? AND is_deleted = 0
+        ''', (user_id, latest_id))
         conn.commit()
         conn.close()
         
@@ -1904,24 +3892,180 @@ def delete_notification(notification_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@app.route('/api/notifications/unread-count', methods=['GET'])
+@app.route('/api/notifications/announcements/<int:announcement_id>/read', methods=['PUT'])
 @api_login_required
-def get_unread_count():
-    """Get count of unread notifications"""
+def mark_announcement_read(announcement_id):
+    """Mark a broadcast notification as read for the current user"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        cursor.execute('SELECT id FROM announcements WHERE id = ?', (announcement_id,))
+        if not cursor.fetchone():
+            conn.close()
+            return jsonify({'success': False, 'message': 'Notification not found'}), 404
+        
         cursor.execute('''
-            SELECT COUNT(*) as count FROM notifications
-            WHERE user_id = ? AND is_read = 0
-        ''', (session['user_id'],))
+            INSERT INTO announcement_reads (user_id, announcement_id, is_read)
+            VALUES (?, ?, 1)
+            ON CONFLICT(user_id, announcement_id) DO UPDATE SET is_read = 1
+        ''', (session['user_id'], announcement_id))
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'success': True, 'message': 'Notification marked as read'}), 200
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/notifications/announcements/<int:announcement_id>', methods=['DELETE'])
+@api_login_required
+def delete_announcement(announcement_id):
+    """Hide a broadcast notification from the current user's feed"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT id FROM announcements WHERE id = ?', (announcement_id,))
+        if not cursor.fetchone():
+            conn.close()
+            return jsonify({'success': False, 'message': 'Notification not found'}), 404
+        
+        cursor.execute('''
+            INSERT INTO announcement_reads (user_id, announcement_id, is_read, is_deleted)
+            VALUES (?, ?, 1, 1)
+            ON CONFLICT(user_id, announcement_id) DO UPDATE SET is_read = 1, is_deleted = 1
+        ''', (session['user_id'], announcement_id))
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'success': True, 'message': 'Notification deleted'}), 200
         
-        result = cursor.fetchone()
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/notifications/unread-count', methods=['GET'])
+@api_login_required
+def get_unread_count():
+    """Get count of unread notifications"""
+    try:
+        conn = get_db_connection()
+        count, _ = count_unread_notifications(conn.cursor(), session['user_id'])
         conn.close()
         
-        return jsonify({'success': True, 'count': result['count']}), 200
+        return jsonify({'success': True, 'count': count}), 200
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+class UnreadCounter:
+    """A connection's unread count, kept current from pushed events"""
+    
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.count = 0
+        self.event_id = 0
+    
+    def refresh(self):
+        conn = db_pool.acquire()
+        try:
+            self.count, self.event_id = count_unread_notifications(conn.cursor(), self.user_id)
+        finally:
+            conn.close()
+    
+    def wants(self, event):
+        data = event['data']
+        if data.get('kind') == 'announcement':
+            return data.get('exclude_user_id') != self.user_id
+        if 'recipients' in data:
+            # A fan-out batch: {user id: notification id}
+            return str(self.user_id) in data['recipients']
+        return data.get('user_id') == self.user_id
+    
+    def apply(self, event):
+        """True if the count may have changed; only read-state changes hit the database"""
+        if event['id'] <= self.event_id:
+            return False
+        self.event_id = event['id']
+        if event['event'] == 'notification':
+            if not event['data'].get('is_read'):
+                self.count += 1
+            return True
+        self.refresh()
+        return True
+
+def notification_message(event, user_id):
+    """The public shape of a notification event for user_id (same fields as GET /api/notifications)"""
+    data = dict(event['data'])
+    recipients = data.pop('recipients', None)
+    if recipients:
+        data['id'] = recipients[str(user_id)]
+    data.pop('user_id', None)
+    data.pop('exclude_user_id', None)
+    return data
+
+@app.route('/api/notifications/stream', methods=['GET'])
+@api_login_required
+def stream_notifications():
+    """Push new notifications and unread-count changes (Server-Sent Events)"""
+    try:
+        counter = UnreadCounter(session['user_id'])
+        
+        def initial():
+            counter.refresh()
+            yield sse_message(None, 'unread_count', {'count': counter.count})
+        
+        def render(event):
+            messages = []
+            if event['event'] == 'notification':
+                messages.append(sse_message(event['id'], 'notification', notification_message(event, counter.user_id)))
+            if counter.apply(event):
+                # Read-state events only carry the new count
+                event_id = None if messages else event['id']
+                messages.append(sse_message(event_id, 'unread_count', {'count': counter.count}))
+            return messages
+        
+        return event_stream(['notifications'], counter.wants, parse_last_event_id(), initial=initial, render=render,
+                            user_id=counter.user_id)
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/notifications/poll', methods=['GET'])
+@api_login_required
+def poll_notifications():
+    """Long-poll fallback for clients without EventSource: waits for events after ?after="""
+    try:
+        after = request.args.get('after', type=int)
+        timeout = request.args.get('timeout', LONG_POLL_SECONDS, type=float)
+        timeout = max(0.0, min(timeout, LONG_POLL_SECONDS))
+        
+        counter = UnreadCounter(session['user_id'])
+        counter.refresh()
+        if after is None:
+            # First call: just hand out the starting point
+            return jsonify({
+                'success': True, 'notifications': [], 'unread_count': counter.count,
+                'last_event_id': counter.event_id
+            }), 200
+        
+        events = wait_for_events(['notifications'], counter.wants, after, timeout, counter.user_id)
+        if events is None:
+            return jsonify({
+                'success': True, 'reset': True, 'notifications': [], 'unread_count': counter.count,
+                'last_event_id': counter.event_id
+            }), 200
+        for event in events:
+            counter.apply(event)
+        last_event_id = max([after, counter.event_id] + [event['id'] for event in events])
         
+        return jsonify({
+            'success': True,
+            'notifications': [notification_message(event, counter.user_id) for event in events if event['event'] == 'notification'],
+            'unread_count': counter.count,
+            'last_event_id': last_event_id
+        }), 200
+    
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -1955,24 +4099,804 @@ def upload_file():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
-# Perplexity API configuration
-PERPLEXITY_API_KEY = "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"
-PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+# Perplexity API configuration
+PERPLEXITY_API_KEY = "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"
+PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+
+# ==========================================
+# UPSTREAM RATE BUDGET
+# ==========================================
+# One token bucket per upstream, kept in SQLite so web workers and CLI jobs
+# draw from the same budget. Live requests are charged but never wait (the
+# bucket can go into debt); batch jobs reserve a token before each call, so
+# they slow down when farmers are using the budget.
+
+UPSTREAM_RATE_PER_MINUTE = float(os.getenv('UPSTREAM_RATE_PER_MINUTE', '30'))
+UPSTREAM_BURST = float(os.getenv('UPSTREAM_BURST', '10'))
+
+class RateBudget:
+    """Cross-process token bucket refilled at per_minute tokens a minute"""
+    
+    def __init__(self, name, per_minute, burst):
+        self.name = name
+        self.per_minute = per_minute
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.counts = {'charged': 0, 'reserved': 0, 'waits': 0, 'refunded': 0}
+    
+    def _take(self, floor):
+        """Take one token unless that would drop below floor; (taken, seconds until one is free)"""
+        conn = db_pool.acquire()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated_at FROM rate_budgets WHERE name = ?', (self.name,)).fetchone()
+            now = time.time()
+            tokens = self.burst
+            if row:
+                tokens = min(self.burst, row['tokens'] + (now - row['updated_at']) * self.per_minute / 60)
+            taken = tokens - 1 >= floor
+            if taken:
+                tokens -= 1
+            conn.execute('''
+                INSERT INTO rate_budgets (name, tokens, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+            ''', (self.name, tokens, now))
+            conn.commit()
+        finally:
+            conn.close()
+        return taken, max(0.0, 1 - tokens) * 60 / self.per_minute
+    
+    def charge(self):
+        """Record a live call; debt is capped at one burst"""
+        self._take(-self.burst)
+        with self.lock:
+            self.counts['charged'] += 1
+    
+    def reserve(self, deadline=None):
+        """Block until a token is free and take it; False if deadline (epoch seconds) passes first"""
+        while True:
+            # Checked before taking, so a job past its window never spends a token
+            if deadline is not None and time.time() >= deadline:
+                return False
+            taken, wait = self._take(0)
+            if taken:
+                with self.lock:
+                    self.counts['reserved'] += 1
+                return True
+            if deadline is not None and time.time() + wait > deadline:
+                return False
+            with self.lock:
+                self.counts['waits'] += 1
+            time.sleep(min(wait, 5.0))
+    
+    def refund(self):
+        """Give back a reserved token whose call never went out"""
+        conn = db_pool.acquire()
+        try:
+            conn.execute('UPDATE rate_budgets SET tokens = MIN(?, tokens + 1) WHERE name = ?', (self.burst, self.name))
+            conn.commit()
+        finally:
+            conn.close()
+        with self.lock:
+            self.counts['refunded'] += 1
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, per_minute=self.per_minute, burst=self.burst)
+
+perplexity_budget = RateBudget('perplexity', UPSTREAM_RATE_PER_MINUTE, UPSTREAM_BURST)
+register_metrics('perplexity_budget', perplexity_budget.stats)
+
+# ==========================================
+# UPSTREAM AI CLIENT
+# ==========================================
+# Every AI feature goes through one client per upstream. The client remembers
+# the model that last worked and tries it first. A model that returns a model
+# error is demoted for MODEL_DEMOTION_SECONDS. A circuit breaker fails fast for
+# UPSTREAM_RESET_SECONDS after UPSTREAM_FAILURE_THRESHOLD consecutive outages
+# (network errors, timeouts, 408/429/5xx), then lets a single probe through.
+# Calls go over a keep-alive session per upstream; connection errors and
+# 5xx are retried UPSTREAM_RETRIES times with jittered backoff first, within
+# UPSTREAM_MAX_RETRY_SLEEP seconds. Every request sent is charged to the budget.
+
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '10'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '5'))
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '2'))
+UPSTREAM_BACKOFF = 0.5            # seconds, doubled per retry and jittered
+# 429 is not retried in-band: the breaker and the rate budget handle it
+UPSTREAM_RETRY_STATUSES = (500, 502, 503, 504)
+UPSTREAM_MAX_RETRY_SLEEP = 3.0    # seconds of backoff per call, all retries together
+PERPLEXITY_MODELS = ["sonar-small-online", "sonar-pro", "sonar-medium-online", "llama-3.1-sonar-small-128k-online"]
+OPENAI_MODELS = ["gpt-4o-mini"]
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv('UPSTREAM_FAILURE_THRESHOLD', '5'))
+UPSTREAM_RESET_SECONDS = float(os.getenv('UPSTREAM_RESET_SECONDS', '30'))
+MODEL_DEMOTION_SECONDS = 3600
+UPSTREAM_OUTAGE_STATUSES = (408, 429)
+
+class HttpPool:
+    """Keep-alive requests.Session for one upstream with retries and latency metrics"""
+    
+    def __init__(self, name, pool_size, connect_timeout, retries, backoff):
+        self.name = name
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=200)
+        self.counts = {'requests': 0, 'retries': 0, 'errors': 0}
+        self.statuses = {}
+        self._reset()
+    
+    def _reset(self):
+        # Sockets must not be shared with a forked parent
+        self.pid = os.getpid()
+        self.session = requests.Session()
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+    
+    def _session(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            return self.session
+    
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+        if retry_after.isdigit():
+            return int(retry_after)
+        # Full jitter so workers that failed together don't retry together
+        return random.uniform(0, self.backoff * (2 ** attempt))
+    
+    def _backoff(self, attempt, slept, response=None):
+        """Seconds slept before the next attempt; None if out of retries or of UPSTREAM_MAX_RETRY_SLEEP"""
+        delay = self._retry_delay(attempt, response)
+        if attempt >= self.retries or slept + delay > UPSTREAM_MAX_RETRY_SLEEP:
+            return None
+        self._count('retries')
+        time.sleep(delay)
+        return delay
+    
+    def post(self, url, timeout, on_attempt=None, **kwargs):
+        """POST with (connect, read) timeouts, retrying connection errors and 5xx
+
+        on_attempt is called before every request sent, retries included.
+        """
+        session = self._session()
+        slept = 0.0
+        for attempt in range(self.retries + 1):
+            if on_attempt:
+                on_attempt()
+            started = time.monotonic()
+            try:
+                response = session.post(url, timeout=(self.connect_timeout, timeout), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+                self._record(started, type(e).__name__)
+                delay = self._backoff(attempt, slept)
+                if delay is not None:
+                    slept += delay
+                    continue
+                raise
+            except requests.exceptions.RequestException as e:
+                # Read timeouts are not retried: the caller already waited the full timeout
+                self._record(started, type(e).__name__)
+                raise
+            self._record(started, response.status_code)
+            if response.status_code in UPSTREAM_RETRY_STATUSES:
+                delay = self._backoff(attempt, slept, response)
+                if delay is not None:
+                    slept += delay
+                    continue
+            return response
+    
+    def _count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+    
+    def _record(self, started, outcome):
+        with self.lock:
+            self.latencies.append(time.monotonic() - started)
+            self.counts['requests'] += 1
+            if not isinstance(outcome, int) or outcome >= 400:
+                self.counts['errors'] += 1
+            self.statuses[str(outcome)] = self.statuses.get(str(outcome), 0) + 1
+    
+    def stats(self):
+        # urllib3 counts sockets opened vs requests sent per host pool
+        pools = self.adapter.poolmanager.pools
+        opened = sent = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        with self.lock:
+            latencies = sorted(self.latencies)
+            counts = dict(self.counts)
+            statuses = dict(self.statuses)
+        return dict(
+            counts,
+            statuses=statuses,
+            connections_opened=opened,
+            connection_reuse=round(1 - opened / sent, 3) if sent else None,
+            latency_ms={
+                'avg': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else None,
+                'max': round(latencies[-1] * 1000, 1) if latencies else None
+            },
+            pool_size=self.pool_size
+        )
+
+class UpstreamError(Exception):
+    """An upstream call that produced no answer; kind is open, outage, model, http or empty"""
+    
+    def __init__(self, message, kind, retry_after=None):
+        super().__init__(message)
+        self.kind = kind
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """closed -> open after threshold consecutive failures -> half_open probe after reset_seconds"""
+    
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.counts = {'opened': 0, 'fast_fails': 0}
+    
+    def allow(self):
+        """True if a call may go out; in half_open only one probe at a time"""
+        with self.lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+            if self.state == 'closed' or (self.state == 'half_open' and not self.probing):
+                self.probing = self.state == 'half_open'
+                return True
+            self.counts['fast_fails'] += 1
+            return False
+    
+    def is_open(self):
+        """Failing fast right now; unlike allow() this neither counts nor claims the probe"""
+        with self.lock:
+            return self.state == 'open' and time.monotonic() - self.opened_at < self.reset_seconds
+    
+    def retry_after(self):
+        with self.lock:
+            return max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at)))
+    
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.probing = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    self.counts['opened'] += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+    
+    def release(self):
+        """The call ended without telling us about upstream health"""
+        with self.lock:
+            self.probing = False
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, state=self.state, consecutive_failures=self.failures)
+
+class UpstreamClient:
+    """Chat-completions client with model memory and a circuit breaker"""
+    
+    def __init__(self, name, url, api_key, models, budget=None):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.models = list(models)
+        self.budget = budget
+        self.http = HttpPool(name, UPSTREAM_POOL_SIZE, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_RETRIES, UPSTREAM_BACKOFF)
+        self.breaker = CircuitBreaker(UPSTREAM_FAILURE_THRESHOLD, UPSTREAM_RESET_SECONDS)
+        self.lock = threading.Lock()
+        self.preferred = None
+        self.demoted = {}
+        self.counts = {'calls': 0, 'successes': 0, 'failures': 0, 'model_errors': 0}
+    
+    def _count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+    
+    def candidates(self):
+        """Last working model first, demoted models last (still tried if nothing else is left)"""
+        now = time.monotonic()
+        with self.lock:
+            ordered = ([self.preferred] if self.preferred else []) + [m for m in self.models if m != self.preferred]
+            healthy = [m for m in ordered if self.demoted.get(m, 0) <= now]
+            return healthy or ordered
+    
+    def _demote(self, model):
+        with self.lock:
+            self.demoted[model] = time.monotonic() + MODEL_DEMOTION_SECONDS
+            if self.preferred == model:
+                self.preferred = None
+    
+    def _post(self, payload, timeout, on_attempt=None):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        return self.http.post(self.url, timeout, on_attempt=on_attempt, json=payload, headers=headers)
+    
+    def complete(self, messages, temperature=0.7, max_tokens=1000, timeout=30, charge=True):
+        """Answer text from the first model that works; raises UpstreamError
+
+        Every request sent (model fallbacks and retries too) is charged to the
+        budget; charge=False means the caller already reserved the first one.
+        """
+        if not self.breaker.allow():
+            raise UpstreamError(f'{self.name} circuit open', 'open', self.breaker.retry_after())
+        self._count('calls')
+        prepaid = not charge
+        
+        def charge_attempt():
+            nonlocal prepaid
+            if prepaid:
+                prepaid = False
+            elif self.budget:
+                self.budget.charge()
+        
+        error = UpstreamError('No answer returned', 'empty')
+        try:
+            for model_name in self.candidates():
+                payload = {
+                    "model": model_name,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens
+                }
+                try:
+                    response = self._post(payload, timeout, on_attempt=charge_attempt)
+                except requests.exceptions.RequestException as e:
+                    # Network error or timeout: other models won't fare better
+                    error = UpstreamError(str(e), 'outage')
+                    break
+                
+                if response.status_code == 200:
+                    result = response.json()
+                    if 'choices' in result and len(result['choices']) > 0:
+                        content = result['choices'][0]['message']['content']
+                    elif isinstance(result.get('message'), str):
+                        content = result['message']
+                    else:
+                        continue  # Try next model
+                    with self.lock:
+                        self.preferred = model_name
+                    self._count('successes')
+                    self.breaker.record_success()
+                    return content
+                
+                if response.status_code in UPSTREAM_OUTAGE_STATUSES or response.status_code >= 500:
+                    error = UpstreamError(f'HTTP {response.status_code}', 'outage')
+                    break
+                try:
+                    error_msg = response.json().get('error', {}).get('message', '')
+                except ValueError:
+                    error = UpstreamError(f'HTTP {response.status_code}', 'http')
+                    continue
+                if 'model' in error_msg.lower() or 'invalid' in error_msg.lower():
+                    self._demote(model_name)
+                    self._count('model_errors')
+                    error = UpstreamError(error_msg, 'model')
+                    continue  # Try next model
+                error = UpstreamError(error_msg or f'HTTP {response.status_code}', 'http')
+                break  # Different error, don't try other models
+        except Exception:
+            self.breaker.release()
+            raise
+        
+        self._count('failures')
+        if error.kind == 'outage':
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+        raise error
+    
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            counts = dict(self.counts)
+            demoted = sorted(m for m, until in self.demoted.items() if until > now)
+            preferred = self.preferred
+        return dict(counts, preferred_model=preferred, demoted_models=demoted, circuit=self.breaker.stats(),
+                    http=self.http.stats())
+
+perplexity_client = UpstreamClient('perplexity', PERPLEXITY_API_URL, PERPLEXITY_API_KEY, PERPLEXITY_MODELS, perplexity_budget)
+openai_client = UpstreamClient('openai', OPENAI_API_URL, OPENAI_API_KEY, OPENAI_MODELS)
+register_metrics('upstreams', lambda: {client.name: client.stats() for client in (perplexity_client, openai_client)})
+
+def upstream_unavailable(error):
+    """503 with Retry-After while an upstream's circuit is open"""
+    response = jsonify({'success': False, 'message': 'AI service is temporarily unavailable. Please try again in a moment.'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after or int(UPSTREAM_RESET_SECONDS))
+    return response
+
+# ==========================================
+# AI ANSWER CACHE
+# ==========================================
+# Farmers ask the same questions over and over. Successful /api/ai/chat answers
+# are stored in ai_answer_cache (shared by all workers) behind a small
+# in-process LRU, keyed on the normalized question + language + crop context.
+# Hits (memory or SQLite) are counted in memory and written to hits/last_hit_at
+# in one batch every AI_CACHE_HIT_FLUSH_SECONDS, before evicting, and at exit.
+# Send {"no_cache": true} or "Cache-Control: no-cache" to force a fresh answer.
+
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', str(7 * 24 * 3600)))
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', '20000'))
+AI_CACHE_MEMORY_ENTRIES = int(os.getenv('AI_CACHE_MEMORY_ENTRIES', '512'))
+AI_CACHE_HIT_FLUSH_SECONDS = 60   # hits are counted in memory and written in batches
+
+def normalize_question(text):
+    """Case, punctuation and spacing don't change the question"""
+    text = re.sub(r'[^\w\s]', ' ', (text or '').lower())
+    return ' '.join(text.split())
+
+class AnswerCache:
+    """SQLite-backed answer cache with an in-memory LRU in front"""
+    
+    def __init__(self, max_entries, memory_entries, ttl):
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'bypassed': 0, 'stored': 0, 'evicted': 0}
+        self.pending_hits = {}
+        self.hits_flushed = time.monotonic()
+    
+    def key(self, question, language, crop_context):
+        parts = (language or 'en', normalize_question(crop_context), normalize_question(question))
+        return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+    
+    def _count(self, outcome, amount=1):
+        with self.lock:
+            self.counts[outcome] += amount
+    
+    def _remember(self, key, answer, expires):
+        with self.lock:
+            self.memory[key] = (answer, expires)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+    
+    def count_hit(self, key):
+        """hits / last_hit_at for the LRU eviction, written every AI_CACHE_HIT_FLUSH_SECONDS"""
+        with self.lock:
+            self.pending_hits[key] = self.pending_hits.get(key, 0) + 1
+            due = time.monotonic() - self.hits_flushed >= AI_CACHE_HIT_FLUSH_SECONDS
+        if due:
+            self.flush_hits()
+    
+    def flush_hits(self):
+        with self.lock:
+            pending, self.pending_hits = self.pending_hits, {}
+            self.hits_flushed = time.monotonic()
+        if not pending:
+            return
+        conn = db_pool.acquire()
+        try:
+            conn.executemany('''
+                UPDATE ai_answer_cache SET hits = hits + ?, last_hit_at = CURRENT_TIMESTAMP
+                WHERE cache_key = ?
+            ''', [(hits, key) for key, hits in pending.items()])
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            # Busy writer: keep the counts for the next flush
+            with self.lock:
+                for key, hits in pending.items():
+                    self.pending_hits[key] = self.pending_hits.get(key, 0) + hits
+        finally:
+            conn.close()
+    
+    def get(self, key, count=True):
+        """Cached answer for key; count=False reads without touching the hit/miss counters"""
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[1] > time.time():
+                self.memory.move_to_end(key)
+                if count:
+                    self.counts['memory_hits'] += 1
+            elif entry:
+                del self.memory[key]
+                entry = None
+        if entry:
+            self.count_hit(key)
+            return entry[0]
+        
+        conn = db_pool.acquire()
+        try:
+            row = conn.execute('''
+                SELECT answer, CAST(strftime('%s', created_at) AS INTEGER) as created
+                FROM ai_answer_cache
+                WHERE cache_key = ? AND created_at >= datetime('now', ?)
+            ''', (key, f'-{self.ttl} seconds')).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            if count:
+                self._count('misses')
+            return None
+        if count:
+            self._count('db_hits')
+        self.count_hit(key)
+        self._remember(key, row['answer'], row['created'] + self.ttl)
+        return row['answer']
+    
+    def put(self, key, question, language, crop_context, answer):
+        self._remember(key, answer, time.time() + self.ttl)
+        # Eviction orders by last_hit_at, so recent hits must be in the table first
+        self.flush_hits()
+        conn = db_pool.acquire()
+        try:
+            conn.execute('''
+                INSERT INTO ai_answer_cache (cache_key, question, language, crop_context, answer)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    answer = excluded.answer,
+                    created_at = CURRENT_TIMESTAMP,
+                    last_hit_at = CURRENT_TIMESTAMP
+            ''', (key, question, language, crop_context or '', answer))
+            # Expired rows first, then the least recently used beyond the size cap
+            evicted = conn.execute("DELETE FROM ai_answer_cache WHERE created_at < datetime('now', ?)",
+                                   (f'-{self.ttl} seconds',)).rowcount
+            evicted += conn.execute('''
+                DELETE FROM ai_answer_cache WHERE cache_key IN (
+                    SELECT cache_key FROM ai_answer_cache ORDER BY last_hit_at
+                    LIMIT MAX((SELECT COUNT(*) FROM ai_answer_cache) - ?, 0)
+                )
+            ''', (self.max_entries,)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        self._count('stored')
+        self._count('evicted', max(evicted, 0))
+    
+    def record_bypass(self):
+        self._count('bypassed')
+    
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+            memory = len(self.memory)
+            pending_hits = sum(self.pending_hits.values())
+        lookups = counts['memory_hits'] + counts['db_hits'] + counts['misses']
+        hits = counts['memory_hits'] + counts['db_hits']
+        return dict(counts, memory_entries=memory, pending_hits=pending_hits, max_entries=self.max_entries, ttl_seconds=self.ttl,
+                    hit_ratio=round(hits / lookups, 3) if lookups else 0.0)
+
+ai_answer_cache = AnswerCache(AI_CACHE_MAX_ENTRIES, AI_CACHE_MEMORY_ENTRIES, AI_CACHE_TTL)
+atexit.register(ai_answer_cache.flush_hits)
+register_metrics('ai_answer_cache', ai_answer_cache.stats)
+
+# Rewordings ("best fertilizer for paddy" / "paddy fertilizer") miss the exact
+# key, so each worker also keeps a per-language index of answered questions as
+# hashed bag-of-words vectors (order-free, plurals folded) and reuses an answer
+# above a cosine threshold. Words that flip the answer (when/how, with/without,
+# not) must match exactly before the vectors are compared at all.
+AI_SEMANTIC_THRESHOLD = float(os.getenv('AI_SEMANTIC_THRESHOLD', '0.9'))
+AI_SEMANTIC_NEAR_MISS = 0.1       # scores this far below the threshold are logged
+AI_SEMANTIC_MAX_ENTRIES = int(os.getenv('AI_SEMANTIC_MAX_ENTRIES', '2000'))
+AI_SEMANTIC_DIMENSIONS = 1024
+AI_SEMANTIC_RELOAD_SECONDS = 300  # picks up answers stored by other workers
+
+# Filler words that don't change what is being asked
+SEMANTIC_STOPWORDS = frozenset('''
+    a an the for of in on to is are was be best good my i me we our
+    please tell about do does should can could and or at by from crop crops farming
+'''.split())
+# Questions only share an answer when they use the same set of these
+SEMANTIC_INTENT_WORDS = frozenset('''
+    when how why where with without not no
+'''.split())
+# Spellings and local names of the same thing; never broader terms
+SEMANTIC_SYNONYMS = {
+    'paddy': 'rice', 'dhan': 'rice', 'chawal': 'rice', 'gehu': 'wheat',
+    'maize': 'corn', 'makka': 'corn', 'groundnut': 'peanut', 'chilli': 'chili', 'chillies': 'chili',
+    'fertiliser': 'fertilizer',
+}
+
+def singular(word):
+    """Fold common English plurals: tomatoes -> tomato, varieties -> variety, pests -> pest"""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('oes', 'ches', 'shes', 'sses', 'xes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+def semantic_words(text):
+    words = []
+    for word in normalize_question(text).split():
+        if word in SEMANTIC_STOPWORDS or word in SEMANTIC_INTENT_WORDS:
+            words.append(word)
+            continue
+        word = singular(SEMANTIC_SYNONYMS.get(word, word))
+        words.append(SEMANTIC_SYNONYMS.get(word, word))
+    return [word for word in words if word not in SEMANTIC_STOPWORDS]
+
+def semantic_intent(text):
+    """The answer-changing words of a question; matches require the same set"""
+    return frozenset(word for word in semantic_words(text) if word in SEMANTIC_INTENT_WORDS)
+
+def semantic_vector(text):
+    """L2-normalized hashed bag of the question's content words (order-free)"""
+    counts = {}
+    for word in semantic_words(text):
+        if word in SEMANTIC_INTENT_WORDS:
+            continue
+        bucket = zlib.crc32(word.encode('utf-8')) % AI_SEMANTIC_DIMENSIONS
+        counts[bucket] = counts.get(bucket, 0) + 1
+    norm = math.sqrt(sum(value * value for value in counts.values()))
+    return {bucket: value / norm for bucket, value in counts.items()} if norm else {}
+
+class SemanticAnswerIndex:
+    """Per-language similarity index over the questions in ai_answer_cache"""
+    
+    def __init__(self, threshold, max_entries):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.partitions = {}
+        self.near_misses = deque(maxlen=20)
+        self.counts = {'lookups': 0, 'matches': 0, 'near_misses': 0, 'reloads': 0}
+    
+    def _load(self, language):
+        conn = db_pool.acquire()
+        try:
+            rows = conn.execute('''
+                SELECT cache_key, question, crop_context FROM ai_answer_cache
+                WHERE language = ?
+                ORDER BY last_hit_at DESC
+                LIMIT ?
+            ''', (language, self.max_entries)).fetchall()
+        finally:
+            conn.close()
+        partition = {'loaded': time.monotonic(), 'keys': [], 'questions': [], 'contexts': [], 'intents': [],
+                     'vectors': [], 'matrix': None}
+        for row in reversed(rows):
+            self._append(partition, row['cache_key'], row['question'], row['crop_context'])
+        self.counts['reloads'] += 1
+        return partition
+    
+    def _partition(self, language):
+        partition = self.partitions.get(language)
+        if partition is None or time.monotonic() - partition['loaded'] > AI_SEMANTIC_RELOAD_SECONDS:
+            partition = self.partitions[language] = self._load(language)
+        return partition
+    
+    def _append(self, partition, key, question, crop_context):
+        vector = semantic_vector(question)
+        if not vector:
+            return
+        if key in partition['keys']:
+            index = partition['keys'].index(key)
+            for field in ('keys', 'questions', 'contexts', 'intents', 'vectors'):
+                del partition[field][index]
+        partition['keys'].append(key)
+        partition['questions'].append(question)
+        partition['contexts'].append(normalize_question(crop_context))
+        partition['intents'].append(semantic_intent(question))
+        partition['vectors'].append(vector)
+        while len(partition['keys']) > self.max_entries:
+            for field in ('keys', 'questions', 'contexts', 'intents', 'vectors'):
+                del partition[field][0]
+        partition['matrix'] = None
+    
+    def _scores(self, partition, vector):
+        if numpy is not None:
+            if partition['matrix'] is None:
+                matrix = numpy.zeros((len(partition['vectors']), AI_SEMANTIC_DIMENSIONS), dtype=numpy.float32)
+                for row, entry in enumerate(partition['vectors']):
+                    matrix[row, list(entry)] = list(entry.values())
+                partition['matrix'] = matrix
+            query = numpy.zeros(AI_SEMANTIC_DIMENSIONS, dtype=numpy.float32)
+            query[list(vector)] = list(vector.values())
+            return (partition['matrix'] @ query).tolist()
+        return [sum(weight * entry.get(bucket, 0.0) for bucket, weight in vector.items())
+                for entry in partition['vectors']]
+    
+    def lookup(self, question, language, crop_context):
+        """(cache_key, matched question, score) of the closest answered question, or None"""
+        vector = semantic_vector(question)
+        if not vector:
+            return None
+        context = normalize_question(crop_context)
+        intent = semantic_intent(question)
+        with self.lock:
+            self.counts['lookups'] += 1
+            partition = self._partition(language)
+            if not partition['keys']:
+                return None
+            scores = self._scores(partition, vector)
+            best, best_score = None, 0.0
+            for index, score in enumerate(scores):
+                if (score > best_score and partition['contexts'][index] == context
+                        and partition['intents'][index] == intent):
+                    best, best_score = index, score
+            if best is None:
+                return None
+            match = (partition['keys'][best], partition['questions'][best], round(best_score, 3))
+            if best_score >= self.threshold:
+                self.counts['matches'] += 1
+                return match
+            if best_score >= self.threshold - AI_SEMANTIC_NEAR_MISS:
+                self.counts['near_misses'] += 1
+                # Scores only: /api/metrics is public, the questions stay in the server log
+                self.near_misses.append(match[2])
+                print(f"AI semantic cache near miss ({best_score:.2f}): {question!r} ~ {match[1]!r}")
+        return None
+    
+    def add(self, key, question, language, crop_context):
+        with self.lock:
+            partition = self.partitions.get(language)
+            if partition is not None:
+                self._append(partition, key, question, crop_context)
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, threshold=self.threshold, backend='numpy' if numpy is not None else 'python',
+                        entries={language: len(p['keys']) for language, p in self.partitions.items()},
+                        recent_near_miss_scores=list(self.near_misses))
+
+semantic_answer_index = SemanticAnswerIndex(AI_SEMANTIC_THRESHOLD, AI_SEMANTIC_MAX_ENTRIES)
+register_metrics('ai_semantic_index', semantic_answer_index.stats)
 
-@app.route('/api/crop/details', methods=['POST'])
-def get_crop_details():
-    """Get comprehensive crop details using Perplexity API"""
-    try:
-        data = request.get_json()
-        crop_name = data.get('crop_name', '').strip()
-        
-        if not crop_name:
-            return jsonify({'success': False, 'message': 'Crop name is required'}), 400
-        
-        # Build comprehensive prompt for crop details
-        prompt = f"""Provide comprehensive cultivation information for "{crop_name}" crop for Indian farmers. Structure the information EXACTLY with the following emoji headings and sections:
+def cache_bypassed(data):
+    """Client asked for a fresh answer"""
+    return bool(data.get('no_cache')) or 'no-cache' in request.headers.get('Cache-Control', '').lower()
+
+# ==========================================
+# CROP DETAILS STORE
+# ==========================================
+# There are a few hundred crops and a guide barely changes week to week, so
+# generated guides are kept (zlib-compressed) in crop_details. A fresh row is
+# served as is; a stale one is served at once and refreshed in the background
+# (stale-while-revalidate); only missing or expired rows wait on the upstream.
+
+CROP_DETAILS_FRESH_SECONDS = int(os.getenv('CROP_DETAILS_FRESH_SECONDS', str(7 * 24 * 3600)))
+CROP_DETAILS_MAX_AGE_SECONDS = int(os.getenv('CROP_DETAILS_MAX_AGE_SECONDS', str(90 * 24 * 3600)))
+CROP_REFRESH_CONCURRENCY = int(os.getenv('CROP_REFRESH_CONCURRENCY', '2'))
+CROP_FETCH_TIMEOUT = 45
+CROP_DEMAND_FLUSH_SECONDS = 60    # lookups are counted in memory and written in batches
+
+AI_LANGUAGE_NAMES = {
+    "en": "English",
+    "te": "Telugu",
+    "hi": "Hindi",
+    "ta": "Tamil",
+    "kn": "Kannada"
+}
+
+def build_crop_prompt(crop_name, language='en'):
+    """The sectioned cultivation guide prompt for one crop"""
+    language_instruction = ""
+    if language != 'en':
+        language_instruction = f"Please respond in {AI_LANGUAGE_NAMES.get(language, 'English')} language. "
+    
+    return f"""{language_instruction}Provide comprehensive cultivation information for "{crop_name}" crop for Indian farmers. Structure the information EXACTLY with the following emoji headings and sections:
 
 🧠 Crop Overview
 - Brief description, botanical name and family
@@ -2057,70 +4981,420 @@ def get_crop_details():
 - Final recommendation for farmers
 
 Format with emoji headings EXACTLY as shown above. Use bullet points (•) for details under each section. Keep language simple and practical for farmers. Include specific numbers and data where possible."""
+
+def fetch_crop_details(crop_name, language='en', charge=True):
+    """Ask the upstream for a crop guide: (text, None) or (None, error)"""
+    prompt = build_crop_prompt(crop_name, language)
+
+    try:
+        text = perplexity_client.complete([
+            {
+                "role": "system",
+                "content": "You are an expert agricultural advisor for Indian farmers. Provide detailed, accurate, and practical farming information."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ], temperature=0.7, max_tokens=4000, timeout=CROP_FETCH_TIMEOUT, charge=charge)
+        return text, None
+    except UpstreamError as e:
+        return None, e
+
+class CropDetailsStore:
+    """crop_details rows with a freshness policy and background refresh"""
+    
+    def __init__(self, fresh_seconds, max_age_seconds, refresh_concurrency):
+        self.fresh_seconds = fresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self.refresh_slots = threading.BoundedSemaphore(refresh_concurrency)
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.demand = {}
+        self.demand_flushed = time.monotonic()
+        self.counts = {'fresh_hits': 0, 'stale_hits': 0, 'misses': 0, 'fetches': 0, 'fetch_failures': 0,
+                       'refreshes': 0, 'refresh_skipped': 0, 'stored_bytes': 0, 'raw_bytes': 0}
+    
+    def _count(self, outcome, amount=1):
+        with self.lock:
+            self.counts[outcome] += amount
+    
+    @staticmethod
+    def key(crop_name):
+        return normalize_question(crop_name)
+    
+    @staticmethod
+    def check_language(language):
+        if language not in AI_LANGUAGE_NAMES:
+            raise ValueError(f'Unsupported language: {language}')
+    
+    def count_demand(self, crop_name, language):
+        """Demand signal for the warm-up job, written every CROP_DEMAND_FLUSH_SECONDS"""
+        demand_key = (self.key(crop_name), language)
+        with self.lock:
+            self.demand[demand_key] = self.demand.get(demand_key, 0) + 1
+            due = time.monotonic() - self.demand_flushed >= CROP_DEMAND_FLUSH_SECONDS
+        if due:
+            self.flush_demand()
+    
+    def flush_demand(self):
+        with self.lock:
+            demand, self.demand = self.demand, {}
+            self.demand_flushed = time.monotonic()
+        if not demand:
+            return
+        conn = db_pool.acquire()
+        try:
+            conn.executemany('''
+                UPDATE crop_details SET request_count = request_count + ?, last_requested_at = CURRENT_TIMESTAMP
+                WHERE crop_key = ? AND language = ?
+            ''', [(count, crop_key, language) for (crop_key, language), count in demand.items()])
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            # Busy writer: keep the counts for the next flush
+            with self.lock:
+                for demand_key, count in demand.items():
+                    self.demand[demand_key] = self.demand.get(demand_key, 0) + count
+        finally:
+            conn.close()
+    
+    def read(self, crop_name, language, count_request=False, sections=None):
+        """(text, age in seconds) or None; with sections, ({slug: text}, age) from the section rows"""
+        body = 'NULL' if sections is not None else 'body'
+        conn = db_pool.acquire()
+        try:
+            row = conn.execute(f'''
+                SELECT {body} as body, CAST(strftime('%s', 'now') - strftime('%s', generated_at) AS INTEGER) as age
+                FROM crop_details WHERE crop_key = ? AND language = ?
+            ''', (self.key(crop_name), language)).fetchone()
+            if row and sections is not None:
+                placeholders = ', '.join('?' for _ in sections)
+                parts = conn.execute(f'''
+                    SELECT section, body FROM crop_detail_sections
+                    WHERE crop_key = ? AND language = ? AND section IN ({placeholders})
+                ''', [self.key(crop_name), language] + list(sections)).fetchall()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        if count_request:
+            self.count_demand(crop_name, language)
+        if sections is not None:
+            return {part['section']: zlib.decompress(part['body']).decode('utf-8') for part in parts}, row['age']
+        return zlib.decompress(row['body']).decode('utf-8'), row['age']
+    
+    def write(self, crop_name, language, text, requested=False):
+        self.check_language(language)
+        body = zlib.compress(text.encode('utf-8'), 6)
+        conn = db_pool.acquire()
+        try:
+            conn.execute('''
+                INSERT INTO crop_details (crop_key, language, crop_name, body, generated_at, request_count, last_requested_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END)
+                ON CONFLICT(crop_key, language) DO UPDATE SET
+                    crop_name = excluded.crop_name,
+                    body = excluded.body,
+                    generated_at = excluded.generated_at,
+                    request_count = request_count + excluded.request_count,
+                    last_requested_at = COALESCE(excluded.last_requested_at, last_requested_at)
+            ''', (self.key(crop_name), language, crop_name, body, int(requested), int(requested)))
+            conn.execute('DELETE FROM crop_detail_sections WHERE crop_key = ? AND language = ?',
+                         (self.key(crop_name), language))
+            conn.executemany('''
+                INSERT INTO crop_detail_sections (crop_key, language, section, body) VALUES (?, ?, ?, ?)
+            ''', [(self.key(crop_name), language, slug, zlib.compress(part.encode('utf-8'), 6))
+                  for slug, part in parse_crop_sections(text).items()])
+            conn.commit()
+        finally:
+            conn.close()
+        self._count('raw_bytes', len(text.encode('utf-8')))
+        self._count('stored_bytes', len(body))
+    
+    def generate(self, crop_name, language, requested=False, charge=True):
+        """Fetch and store one guide; concurrent callers for the same crop share one upstream call"""
+        self.check_language(language)
+        flight_key = (self.key(crop_name), language)
+        with self.lock:
+            pending = self.inflight.get(flight_key)
+            leader = pending is None
+            if leader:
+                pending = self.inflight[flight_key] = threading.Event()
+        if not leader:
+            pending.wait(CROP_FETCH_TIMEOUT + 5)
+            stored = self.read(crop_name, language)
+            return (stored[0], None) if stored else (None, 'No details returned')
+        try:
+            self._count('fetches')
+            text, error = fetch_crop_details(crop_name, language, charge)
+            if text is None:
+                self._count('fetch_failures')
+                return None, error
+            self.write(crop_name, language, text, requested)
+            return text, None
+        finally:
+            with self.lock:
+                del self.inflight[flight_key]
+            pending.set()
+    
+    def refresh_async(self, crop_name, language):
+        """Regenerate in the background unless the refresh slots are all busy"""
+        if not self.refresh_slots.acquire(blocking=False):
+            self._count('refresh_skipped')
+            return False
         
-        # Prepare headers
-        headers = {
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        # Try different models
-        models_to_try = ["sonar-small-online", "sonar-pro", "sonar-medium-online", "llama-3.1-sonar-small-128k-online"]
+        def run():
+            try:
+                self._count('refreshes')
+                self.generate(crop_name, language)
+            except Exception as e:
+                print(f"Crop details refresh failed for {crop_name}: {e}")
+            finally:
+                self.refresh_slots.release()
         
-        last_error = None
-        for model_name in models_to_try:
+        threading.Thread(target=run, name='crop-refresh', daemon=True).start()
+        return True
+    
+    def lookup(self, crop_name, language, sections=None):
+        """(text, meta, error) following the freshness policy; {slug: text} when sections are given"""
+        self.check_language(language)
+        stored = self.read(crop_name, language, count_request=True, sections=sections)
+        if stored and stored[1] < self.max_age_seconds:
+            text, age = stored
+            stale = age >= self.fresh_seconds
+            if stale:
+                self._count('stale_hits')
+                self.refresh_async(crop_name, language)
+            else:
+                self._count('fresh_hits')
+            return text, {'cached': True, 'stale': stale, 'age_seconds': age}, None
+        self._count('misses')
+        text, error = self.generate(crop_name, language, requested=True)
+        if text is not None and sections is not None:
+            parsed = parse_crop_sections(text)
+            text = {slug: parsed[slug] for slug in sections if slug in parsed}
+        if text is None and stored:
+            # Upstream down: an expired guide beats no guide
+            return stored[0], {'cached': True, 'stale': True, 'age_seconds': stored[1]}, None
+        return text, {'cached': False, 'stale': False, 'age_seconds': 0}, error
+    
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+            inflight = len(self.inflight)
+        lookups = counts['fresh_hits'] + counts['stale_hits'] + counts['misses']
+        hits = counts['fresh_hits'] + counts['stale_hits']
+        with self.lock:
+            pending_demand = sum(self.demand.values())
+        return dict(counts, inflight=inflight, pending_demand=pending_demand, fresh_seconds=self.fresh_seconds,
+                    hit_ratio=round(hits / lookups, 3) if lookups else 0.0,
+                    compression_ratio=round(counts['stored_bytes'] / counts['raw_bytes'], 3) if counts['raw_bytes'] else None)
+
+crop_store = CropDetailsStore(CROP_DETAILS_FRESH_SECONDS, CROP_DETAILS_MAX_AGE_SECONDS, CROP_REFRESH_CONCURRENCY)
+atexit.register(crop_store.flush_demand)
+register_metrics('crop_details', crop_store.stats)
+
+# Always warmed, whatever the demand data says
+CROP_SEED_LIST = [
+    'Paddy', 'Wheat', 'Maize', 'Cotton', 'Sugarcane', 'Groundnut', 'Soybean', 'Red Gram',
+    'Bengal Gram', 'Green Gram', 'Black Gram', 'Jowar', 'Bajra', 'Ragi', 'Chilli', 'Turmeric',
+    'Tomato', 'Onion', 'Potato', 'Brinjal', 'Okra', 'Cabbage', 'Cauliflower', 'Banana',
+    'Mango', 'Papaya', 'Coconut', 'Mustard', 'Sunflower', 'Castor',
+]
+
+def most_requested_crops(limit):
+    """Crop names by demand: past guide lookups first, then crops named in products farmers contacted about"""
+    conn = db_pool.acquire()
+    try:
+        guides = conn.execute('''
+            SELECT crop_key, MAX(crop_name) as crop_name, SUM(request_count) as requests FROM crop_details
+            GROUP BY crop_key
+            ORDER BY requests DESC
+        ''').fetchall()
+        titles = conn.execute('''
+            SELECT item_name, COUNT(*) as contacts FROM user_history
+            WHERE item_type = 'product' AND item_name IS NOT NULL
+            GROUP BY item_name COLLATE NOCASE
+        ''').fetchall()
+    finally:
+        conn.close()
+    names = [row['crop_name'] for row in guides[:limit]]
+    
+    # Product titles ("Fresh Tomatoes 20kg") only count towards a known crop they name
+    known = {CropDetailsStore.key(name): name for name in CROP_SEED_LIST}
+    known.update((row['crop_key'], row['crop_name']) for row in guides)
+    patterns = {key: re.compile(r'\b' + re.escape(key) + r'(?:s|es)?\b') for key in known if key}
+    demand = {}
+    for row in titles:
+        title = normalize_question(row['item_name'])
+        for key, pattern in patterns.items():
+            if pattern.search(title):
+                demand[key] = demand.get(key, 0) + row['contacts']
+    names += [known[key] for key in sorted(demand, key=demand.get, reverse=True)[:limit]]
+    return names
+
+def parse_clock_time(ctx, param, value):
+    """click callback: 'HH:MM' -> (hour, minute)"""
+    if value is None:
+        return None
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', value.strip())
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise click.BadParameter(f'expected HH:MM (24-hour), got {value!r}')
+    return int(match.group(1)), int(match.group(2))
+
+@app.cli.command('warm-crop-details')
+@click.option('--top', default=50, help='How many of the most requested crops to include')
+@click.option('--language', 'languages', multiple=True, default=['en'], type=click.Choice(list(AI_LANGUAGE_NAMES)),
+              help='Language(s) to generate (repeatable)')
+@click.option('--seed/--no-seed', default=True, help='Also warm CROP_SEED_LIST')
+@click.option('--concurrency', default=2, help='Upstream calls in flight at once')
+@click.option('--force', is_flag=True, help='Regenerate guides that are still fresh')
+@click.option('--until', default=None, callback=parse_clock_time,
+              help='Stop starting new crops after this time (HH:MM), e.g. end of off-peak')
+@click.option('--dry-run', is_flag=True, help='List what would be generated')
+def warm_crop_details_command(top, languages, seed, concurrency, force, until, dry_run):
+    """Precompute crop guides for the most requested crops (run from cron off-peak)"""
+    candidates = most_requested_crops(top) + (CROP_SEED_LIST if seed else [])
+    seen = set()
+    crops = []
+    for name in candidates:
+        key = CropDetailsStore.key(name)
+        if key and key not in seen:
+            seen.add(key)
+            crops.append(name.strip())
+    
+    jobs = []
+    skipped = 0
+    for name in crops:
+        for language in languages:
+            stored = None if force else crop_store.read(name, language)
+            if stored and stored[1] < crop_store.fresh_seconds:
+                skipped += 1
+            else:
+                jobs.append((name, language))
+    click.echo(f'{len(jobs)} crop guides to generate, {skipped} already fresh')
+    if dry_run:
+        for name, language in jobs:
+            click.echo(f'  {name} ({language})')
+        return
+    
+    deadline = None
+    if until:
+        hour, minute = until
+        stop_at = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if stop_at <= datetime.now():
+            # A window that ends "before now" ends tomorrow (job started before midnight)
+            stop_at += timedelta(days=1)
+        deadline = stop_at.timestamp()
+    
+    # Once the circuit opens the rest would fail fast too; leave them for the next run
+    upstream_down = threading.Event()
+    
+    def warm(name, language):
+        # Checked before reserving so an open circuit does not drain the budget
+        if upstream_down.is_set() or perplexity_client.breaker.is_open():
+            upstream_down.set()
+            return None, 'upstream unavailable', 0.0
+        if not perplexity_budget.reserve(deadline):
+            return None, 'off-peak window ended', 0.0
+        started = time.monotonic()
+        text, error = crop_store.generate(name, language, charge=False)
+        if isinstance(error, UpstreamError) and error.kind == 'open':
+            # Opened while we waited for the token: nothing was sent, so give it back
+            perplexity_budget.refund()
+            upstream_down.set()
+            return None, 'upstream unavailable', time.monotonic() - started
+        return text, error, time.monotonic() - started
+    
+    done = failed = stopped = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(warm, name, language): (name, language) for name, language in jobs}
+        for future in as_completed(futures):
+            name, language = futures[future]
+            done += 1
             try:
-                payload = {
-                    "model": model_name,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": "You are an expert agricultural advisor for Indian farmers. Provide detailed, accurate, and practical farming information."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 4000
-                }
-                
-                response = requests.post(PERPLEXITY_API_URL, json=payload, headers=headers, timeout=45)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    if 'choices' in result and len(result['choices']) > 0:
-                        crop_info = result['choices'][0]['message']['content']
-                        return jsonify({
-                            'success': True,
-                            'details': crop_info
-                        }), 200
-                    else:
-                        continue
-                else:
-                    try:
-                        error_data = response.json()
-                        error_msg = error_data.get('error', {}).get('message', '')
-                        if 'model' in error_msg.lower() or 'invalid' in error_msg.lower():
-                            last_error = error_msg
-                            continue
-                        else:
-                            last_error = error_msg
-                            break
-                    except:
-                        last_error = f'HTTP {response.status_code}'
-                        continue
-                        
-            except requests.exceptions.RequestException as e:
-                last_error = str(e)
-                break
+                text, error, elapsed = future.result()
+            except Exception as e:
+                text, error, elapsed = None, str(e), 0.0
+            if text is not None:
+                click.echo(f'[{done}/{len(jobs)}] {name} ({language}) ok in {elapsed:.1f}s')
+            elif error in ('off-peak window ended', 'upstream unavailable'):
+                stopped += 1
+            else:
+                failed += 1
+                click.echo(f'[{done}/{len(jobs)}] {name} ({language}) FAILED: {error}', err=True)
+    
+    if upstream_down.is_set():
+        click.echo('Upstream circuit is open; stopped early', err=True)
+    click.echo(f'Warmed {len(jobs) - failed - stopped} crop guides, {failed} failed, {stopped} left for the next run')
+    if failed:
+        raise click.ClickException(f'{failed} crop guides failed')
+
+@app.route('/api/crop/details', methods=['POST'])
+def get_crop_details():
+    """Get comprehensive crop details (stored guide, generated by Perplexity on a miss)"""
+    try:
+        data = request.get_json()
+        crop_name = data.get('crop_name', '').strip()
+        language = data.get('language', 'en')
         
-        return jsonify({
-            'success': False,
-            'message': 'Could not load detailed information. Please try again later.'
-        }), 500
+        if not crop_name:
+            return jsonify({'success': False, 'message': 'Crop name is required'}), 400
+        if language not in AI_LANGUAGE_NAMES:
+            return jsonify({'success': False, 'message': f'Unsupported language: {language}'}), 400
+        
+        crop_info, meta, error = crop_store.lookup(crop_name, language)
+        if crop_info is None:
+            if isinstance(error, UpstreamError) and error.kind == 'open':
+                return upstream_unavailable(error)
+            return jsonify({
+                'success': False,
+                'message': 'Could not load detailed information. Please try again later.'
+            }), 500
+        
+        return jsonify(dict({'success': True, 'details': crop_info}, **meta)), 200
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/crop/details', methods=['GET'])
+def get_crop_detail_sections():
+    """Crop details as sections: ?crop=paddy&sections=pests,irrigation (all sections if omitted)"""
+    try:
+        crop_name = request.args.get('crop', '').strip()
+        language = request.args.get('language', 'en')
+        requested = [slug.strip() for slug in request.args.get('sections', '').split(',') if slug.strip()]
+        
+        if not crop_name:
+            return jsonify({'success': False, 'message': 'Crop name is required'}), 400
+        if language not in AI_LANGUAGE_NAMES:
+            return jsonify({'success': False, 'message': f'Unsupported language: {language}'}), 400
+        unknown = [slug for slug in requested if slug not in CROP_SECTION_TITLES]
+        if unknown:
+            return jsonify({
+                'success': False,
+                'message': f"Unknown section(s): {', '.join(unknown)}",
+                'available': list(CROP_SECTION_TITLES)
+            }), 400
+        
+        sections, meta, error = crop_store.lookup(crop_name, language, requested or list(CROP_SECTION_TITLES))
+        if sections is None:
+            if isinstance(error, UpstreamError) and error.kind == 'open':
+                return upstream_unavailable(error)
+            return jsonify({
+                'success': False,
+                'message': 'Could not load detailed information. Please try again later.'
+            }), 500
+        
+        return jsonify(dict({
+            'success': True,
+            'crop_name': crop_name,
+            'sections': {
+                slug: {'title': CROP_SECTION_TITLES[slug], 'text': sections[slug]}
+                for slug in CROP_SECTION_TITLES if slug in sections
+            }
+        }, **meta)), 200
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -2136,20 +5410,32 @@ def ai_chat():
         
         if not user_message:
             return jsonify({'success': False, 'message': 'Message is required'}), 400
+        # Each language gets its own cache keys and index partition
+        if language not in AI_LANGUAGE_NAMES:
+            return jsonify({'success': False, 'message': f'Unsupported language: {language}'}), 400
         
-        # Language names for prompt
-        language_names = {
-            "en": "English",
-            "te": "Telugu",
-            "hi": "Hindi",
-            "ta": "Tamil",
-            "kn": "Kannada"
-        }
+        cache_key = ai_answer_cache.key(user_message, language, crop_context)
+        if cache_bypassed(data):
+            ai_answer_cache.record_bypass()
+        else:
+            cached_answer = ai_answer_cache.get(cache_key)
+            if cached_answer is not None:
+                return jsonify({'success': True, 'response': cached_answer, 'cached': True}), 200
+            similar = semantic_answer_index.lookup(user_message, language, crop_context)
+            # The exact lookup already counted this request; matches count in the index
+            cached_answer = ai_answer_cache.get(similar[0], count=False) if similar else None
+            if cached_answer is not None:
+                return jsonify({
+                    'success': True,
+                    'response': cached_answer,
+                    'cached': True,
+                    'matched_question': similar[1]
+                }), 200
         
         # Build the prompt
         language_instruction = ""
         if language != 'en':
-            language_instruction = f"Please respond in {language_names.get(language, 'English')} language. "
+            language_instruction = f"Please respond in {AI_LANGUAGE_NAMES.get(language, 'English')} language. "
         
         context_instruction = ""
         if crop_context:
@@ -2175,73 +5461,31 @@ Guidelines:
 - If asked about non-agricultural topics, politely redirect to farming
 """
         
-        # Prepare headers
-        headers = {
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        # Try different model names in order of preference
-        models_to_try = ["sonar-small-online", "sonar-pro", "sonar-medium-online", "llama-3.1-sonar-small-128k-online"]
-        
-        # Try different models until one works
         last_error = None
-        for model_name in models_to_try:
-            try:
-                # Prepare the request payload
-                payload = {
-                    "model": model_name,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": user_message
-                        }
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 1000
+        try:
+            ai_response = perplexity_client.complete([
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": user_message
                 }
-                
-                response = requests.post(PERPLEXITY_API_URL, json=payload, headers=headers, timeout=30)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # Extract the response text
-                    if 'choices' in result and len(result['choices']) > 0:
-                        ai_response = result['choices'][0]['message']['content']
-                    elif 'message' in result:
-                        ai_response = result['message']
-                    else:
-                        continue  # Try next model
-                    
-                    return jsonify({
-                        'success': True,
-                        'response': ai_response
-                    }), 200
-                else:
-                    # Check if it's a model error
-                    try:
-                        error_data = response.json()
-                        error_msg = error_data.get('error', {}).get('message', '')
-                        if 'model' in error_msg.lower() or 'invalid' in error_msg.lower():
-                            last_error = error_msg
-                            continue  # Try next model
-                        else:
-                            last_error = error_msg
-                            break  # Different error, don't try other models
-                    except:
-                        last_error = f'HTTP {response.status_code}'
-                        continue
-                        
-            except requests.exceptions.RequestException as e:
-                last_error = str(e)
-                break  # Network error, don't try other models
+            ], temperature=0.7, max_tokens=1000, timeout=30)
+            
+            ai_answer_cache.put(cache_key, user_message, language, crop_context, ai_response)
+            semantic_answer_index.add(cache_key, user_message, language, crop_context)
+            return jsonify({
+                'success': True,
+                'response': ai_response,
+                'cached': False
+            }), 200
+        except UpstreamError as e:
+            if e.kind == 'open':
+                return upstream_unavailable(e)
+            last_error = str(e)
         
-        # If we get here, all models failed
         # Provide user-friendly error message
         if last_error and ('model' in last_error.lower() or 'invalid' in last_error.lower()):
             error_message = 'AI service configuration issue. Please contact support.'
@@ -2500,72 +5744,27 @@ Return ONLY the JSON array, nothing else."""
         
         def try_extract_with_perplexity():
             nonlocal last_error
-            # Prepare headers
-            headers = {
-                "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            # Try different models
-            models_to_try = ["sonar-small-online", "sonar-pro", "sonar-medium-online", "llama-3.1-sonar-small-128k-online"]
-            
-            for model_name in models_to_try:
-                try:
-                    payload = {
-                        "model": model_name,
-                        "messages": [
-                            {
-                                "role": "system",
-                                "content": "You are an expert at extracting structured information from web content. Always return valid JSON only, no additional text."
-                            },
-                            {
-                                "role": "user",
-                                "content": extraction_prompt
-                            }
-                        ],
-                        "temperature": 0.3,
-                        "max_tokens": 4000
+            try:
+                return perplexity_client.complete([
+                    {
+                        "role": "system",
+                        "content": "You are an expert at extracting structured information from web content. Always return valid JSON only, no additional text."
+                    },
+                    {
+                        "role": "user",
+                        "content": extraction_prompt
                     }
-                    
-                    response = requests.post(PERPLEXITY_API_URL, json=payload, headers=headers, timeout=45)
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        
-                        if 'choices' in result and len(result['choices']) > 0:
-                            return result['choices'][0]['message']['content']
-                        else:
-                            continue
-                    else:
-                        try:
-                            error_data = response.json()
-                            error_msg = error_data.get('error', {}).get('message', '')
-                            if 'model' in error_msg.lower() or 'invalid' in error_msg.lower():
-                                last_error = error_msg
-                                continue
-                            else:
-                                last_error = error_msg
-                                break
-                        except:
-                            last_error = f'HTTP {response.status_code}'
-                            continue
-                            
-                except requests.exceptions.RequestException as e:
-                    last_error = str(e)
-                    break
-            return None
+                ], temperature=0.3, max_tokens=4000, timeout=45)
+            except UpstreamError as e:
+                last_error = str(e)
+                return None
 
         def try_extract_with_openai():
             nonlocal last_error
             if not OPENAI_API_KEY:
                 return None
-            headers = {
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "model": "gpt-4o-mini",
-                "messages": [
+            try:
+                return openai_client.complete([
                     {
                         "role": "system",
                         "content": "You are an expert at extracting structured information from web content. Always return valid JSON only, no additional text."
@@ -2574,25 +5773,10 @@ Return ONLY the JSON array, nothing else."""
                         "role": "user",
                         "content": extraction_prompt
                     }
-                ],
-                "temperature": 0.2,
-                "max_tokens": 3000
-            }
-            try:
-                response = requests.post(OPENAI_API_URL, json=payload, headers=headers, timeout=45)
-                if response.status_code == 200:
-                    result = response.json()
-                    if 'choices' in result and len(result['choices']) > 0:
-                        return result['choices'][0]['message']['content']
-                else:
-                    try:
-                        err = response.json()
-                        last_error = err.get('error', {}).get('message', f'HTTP {response.status_code}')
-                    except:
-                        last_error = f'HTTP {response.status_code}'
-            except requests.exceptions.RequestException as e:
+                ], temperature=0.2, max_tokens=3000, timeout=45)
+            except UpstreamError as e:
                 last_error = str(e)
-            return None
+                return None
 
         def parse_json_response(extracted_text):
             nonlocal last_error
@@ -2719,6 +5903,7 @@ Return ONLY the JSON array, nothing else."""
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/schemes', methods=['GET'])
+@versioned_listing('schemes')
 def get_schemes():
     """Get all saved government schemes"""
     try:
@@ -2788,6 +5973,7 @@ def save_scheme():
         conn.commit()
         scheme_id = cursor.lastrowid
         conn.close()
+        response_cache.invalidate('schemes')
         
         return jsonify({
             'success': True,
@@ -2807,6 +5993,7 @@ def delete_scheme(scheme_id):
         cursor.execute('DELETE FROM government_schemes WHERE id = ?', (scheme_id,))
         conn.commit()
         conn.close()
+        response_cache.invalidate('schemes')
         
         return jsonify({'success': True, 'message': 'Scheme deleted successfully'}), 200
         
@@ -2818,6 +6005,7 @@ def delete_scheme(scheme_id):
 # ==========================================
 
 @app.route('/api/rentals', methods=['GET'])
+@versioned_listing('rentals')
 def get_rentals():
     """Get all rental items with average ratings"""
     try:
@@ -2825,12 +6013,11 @@ def get_rentals():
         cursor = conn.cursor()
         cursor.execute('''
             SELECT r.*, u.name as owner_name, u.phone as owner_phone, u.location as owner_location,
-                   COALESCE(AVG(rf.rating), 0) as avg_rating,
-                   COUNT(rf.id) as review_count
+                   COALESCE(rs.rating_sum * 1.0 / rs.rating_count, 0) as avg_rating,
+                   COALESCE(rs.rating_count, 0) as review_count
             FROM rental_items r
             JOIN users u ON r.user_id = u.id
-            LEFT JOIN rental_feedback rf ON r.id = rf.rental_id
-            GROUP BY r.id
+            LEFT JOIN rating_stats rs ON rs.entity_type = 'rental' AND rs.entity_id = r.id
             ORDER BY r.created_at DESC
         ''')
         rentals = cursor.fetchall()
@@ -2893,22 +6080,16 @@ def create_rental():
         ''', (session['user_id'], name, category, description, price_per_hour, price_per_day, location, json.dumps(images)))
         
         rental_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
         
-        # Create notification for all users (except the creator)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM users WHERE id != ?', (session['user_id'],))
-        users = cursor.fetchall()
-        for user in users:
-            cursor.execute('''
-                INSERT INTO notifications (user_id, category, title, message, related_item_id, related_item_type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user['id'], 'rental_posted', 'New Rental Item Available', 
-                  f'{name} ({category}) is now available for rent', rental_id, 'rental'))
+        # Notify interested users (except the creator)
+        audience = target_audience('rental_posted', exclude_user_id=session['user_id'],
+                                   rental_category=category)
+        enqueue_notification(cursor, audience, 'rental_posted', 'New Rental Item Available',
+                             f'{name} ({category}) is now available for rent', rental_id, 'rental')
         conn.commit()
         conn.close()
+        response_cache.invalidate('rentals')
+        fanout_worker.wake()
         
         return jsonify({
             'success': True,
@@ -2950,12 +6131,7 @@ def get_rental_detail(rental_id):
         feedbacks = cursor.fetchall()
         
         # Calculate average rating
-        cursor.execute('''
-            SELECT COALESCE(AVG(rating), 0) as avg_rating, COUNT(*) as review_count
-            FROM rental_feedback
-            WHERE rental_id = ?
-        ''', (rental_id,))
-        rating_info = cursor.fetchone()
+        avg_rating, review_count = rating_summary(cursor, 'rental', rental_id)
         
         conn.close()
         
@@ -2986,8 +6162,8 @@ def get_rental_detail(rental_id):
                 'owner_name': rental['owner_name'],
                 'owner_phone': rental['owner_phone'],
                 'owner_location': rental['owner_location'],
-                'avg_rating': round(rating_info['avg_rating'], 1),
-                'review_count': rating_info['review_count'],
+                'avg_rating': round(avg_rating, 1),
+                'review_count': review_count,
                 'feedbacks': feedback_list,
                 'created_at': rental['created_at']
             }
@@ -3022,6 +6198,7 @@ def delete_rental(rental_id):
         cursor.execute('DELETE FROM rental_items WHERE id = ?', (rental_id,))
         conn.commit()
         conn.close()
+        response_cache.invalidate('rentals')
         
         return jsonify({'success': True, 'message': 'Rental item deleted successfully'}), 200
         
@@ -3056,12 +6233,7 @@ def get_rental_feedback(rental_id):
         feedbacks = cursor.fetchall()
         
         # Calculate average rating
-        cursor.execute('''
-            SELECT COALESCE(AVG(rating), 0) as avg_rating, COUNT(*) as review_count
-            FROM rental_feedback
-            WHERE rental_id = ?
-        ''', (rental_id,))
-        rating_info = cursor.fetchone()
+        avg_rating, review_count = rating_summary(cursor, 'rental', rental_id)
         
         conn.close()
         
@@ -3077,8 +6249,8 @@ def get_rental_feedback(rental_id):
         
         return jsonify({
             'success': True,
-            'avg_rating': round(rating_info['avg_rating'], 1),
-            'review_count': rating_info['review_count'],
+            'avg_rating': round(avg_rating, 1),
+            'review_count': review_count,
             'feedbacks': feedback_list
         }), 200
         
@@ -3135,21 +6307,17 @@ def submit_rental_feedback(rental_id):
         conn.commit()
         
         # Get updated average rating
-        cursor.execute('''
-            SELECT COALESCE(AVG(rating), 0) as avg_rating, COUNT(*) as review_count
-            FROM rental_feedback
-            WHERE rental_id = ?
-        ''', (rental_id,))
-        rating_info = cursor.fetchone()
+        avg_rating, review_count = rating_summary(cursor, 'rental', rental_id)
         
         conn.close()
+        response_cache.invalidate('rentals')
         
         return jsonify({
             'success': True,
             'message': 'Feedback submitted successfully',
             'feedback_id': feedback_id,
-            'avg_rating': round(rating_info['avg_rating'], 1),
-            'review_count': rating_info['review_count']
+            'avg_rating': round(avg_rating, 1),
+            'review_count': review_count
         }), 201
         
     except Exception as e:
@@ -3184,6 +6352,7 @@ def delete_rental_feedback(rental_id, feedback_id):
         cursor.execute('DELETE FROM rental_feedback WHERE id = ?', (feedback_id,))
         conn.commit()
         conn.close()
+        response_cache.invalidate('rentals')
         
         return jsonify({'success': True, 'message': 'Feedback deleted successfully'}), 200
         
@@ -3753,6 +6922,7 @@ def create_live_price():
         conn.commit()
         price_id = cursor.lastrowid
         conn.close()
+        response_cache.invalidate('live_prices')
 
         return jsonify({'success': True, 'message': 'Live price posted successfully', 'id': price_id}), 201
 
@@ -3760,39 +6930,98 @@ def create_live_price():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+LIVE_PRICES_PAGE_SIZE = int(os.getenv('LIVE_PRICES_PAGE_SIZE', '100'))
+LIVE_PRICES_MAX_PAGE_SIZE = int(os.getenv('LIVE_PRICES_MAX_PAGE_SIZE', '200'))
+
 @app.route('/api/live-prices', methods=['GET'])
+@versioned_listing('live_prices', extra=live_prices_window)
 def get_live_prices():
-    """Get all live price posts (only those within 24 hours)"""
+    """Get one page of live price posts from the last 24 hours, optionally filtered"""
     try:
+        limit = request.args.get('limit', LIVE_PRICES_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, LIVE_PRICES_MAX_PAGE_SIZE))
+        try:
+            after = decode_cursor(request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+        
+        conditions = ["lp.created_at >= datetime('now', '-24 hours')"]
+        params = []
+        for column in LIVE_PRICE_FILTERS:
+            value = request.args.get(column, '').strip()
+            if value:
+                conditions.append(f'lp.{column} = ? COLLATE NOCASE')
+                params.append(value)
+        # Trend and free-text search narrow the 24 hour window before the LIMIT too
+        trend = request.args.get('trend', '').strip().lower()
+        if trend:
+            conditions.append('lp.price_trend = ?')
+            params.append(trend)
+        search = request.args.get('q', '').strip().lower()
+        if search:
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append("(" + ' OR '.join(f"lower(lp.{column}) LIKE ? ESCAPE '\\'" for column in LIVE_PRICE_SEARCH_COLUMNS) + ")")
+            params += [pattern] * len(LIVE_PRICE_SEARCH_COLUMNS)
+        if after:
+            conditions.append('(lp.created_at < ? OR (lp.created_at = ? AND lp.id < ?))')
+            params.extend([after[0], after[0], after[1]])
+        
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT lp.*, u.name as poster_name
+        # One set-based query: feedback stats come from rating_stats, not a query per post
+        cursor.execute(f'''
+            SELECT lp.*, u.name as poster_name,
+                   COALESCE(rs.rating_count, 0) as feedback_count,
+                   COALESCE(rs.rating_sum * 1.0 / rs.rating_count, 0) as avg_rating
             FROM live_prices lp
             LEFT JOIN users u ON lp.user_id = u.id
-            WHERE lp.created_at >= datetime('now', '-24 hours')
-            ORDER BY lp.created_at DESC
-        ''')
+            LEFT JOIN rating_stats rs ON rs.entity_type = 'live_price' AND rs.entity_id = lp.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY lp.created_at DESC, lp.id DESC
+            LIMIT ?
+        ''', params + [limit + 1])
         rows = cursor.fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None
 
         prices = []
         for row in rows:
             price_data = dict(row)
             price_data['images'] = json.loads(price_data.get('images') or '[]')
             price_data['videos'] = json.loads(price_data.get('videos') or '[]')
-            # Get feedback stats
-            cursor.execute('''
-                SELECT COUNT(*) as count, COALESCE(AVG(rating), 0) as avg_rating
-                FROM live_price_feedback WHERE price_id = ?
-            ''', (price_data['id'],))
-            fb = cursor.fetchone()
-            price_data['feedback_count'] = fb['count']
-            price_data['avg_rating'] = round(fb['avg_rating'], 1)
+            price_data['avg_rating'] = round(price_data['avg_rating'], 1)
             prices.append(price_data)
 
         conn.close()
-        return jsonify({'success': True, 'prices': prices}), 200
+        return jsonify({
+            'success': True,
+            'prices': prices,
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }), 200
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
 
+
+@app.route('/api/live-prices/stream', methods=['GET'])
+def stream_live_prices():
+    """Push new posts, feedback and expiries as they happen (Server-Sent Events)"""
+    try:
+        # Same filters as the listing; feedback and expiry payloads carry them too
+        filters = {}
+        for column in ('state', 'district', 'category'):
+            value = request.args.get(column, '').strip().lower()
+            if value:
+                filters[column] = value
+        
+        def matches(event):
+            return all((event['data'].get(column) or '').lower() == value for column, value in filters.items())
+        
+        return event_stream(['live_prices'], matches, parse_last_event_id())
+    
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -3819,13 +7048,9 @@ def get_live_price_detail(price_id):
         price_data['videos'] = json.loads(price_data.get('videos') or '[]')
 
         # Get feedback
-        cursor.execute('''
-            SELECT COUNT(*) as count, COALESCE(AVG(rating), 0) as avg_rating
-            FROM live_price_feedback WHERE price_id = ?
-        ''', (price_id,))
-        fb = cursor.fetchone()
-        price_data['feedback_count'] = fb['count']
-        price_data['avg_rating'] = round(fb['avg_rating'], 1)
+        avg_rating, feedback_count = rating_summary(cursor, 'live_price', price_id)
+        price_data['feedback_count'] = feedback_count
+        price_data['avg_rating'] = round(avg_rating, 1)
 
         # Get individual feedback entries
         cursor.execute('''
@@ -3874,6 +7099,7 @@ def submit_live_price_feedback(price_id):
         ''', (price_id, user_id, farmer_name, int(rating), comment))
         conn.commit()
         conn.close()
+        response_cache.invalidate('live_prices')
 
         return jsonify({'success': True, 'message': 'Feedback submitted successfully'}), 201
 
@@ -3893,19 +7119,15 @@ def get_live_price_feedback(price_id):
         ''', (price_id,))
         feedbacks = [dict(r) for r in cursor.fetchall()]
 
-        cursor.execute('''
-            SELECT COUNT(*) as count, COALESCE(AVG(rating), 0) as avg_rating
-            FROM live_price_feedback WHERE price_id = ?
-        ''', (price_id,))
-        stats = cursor.fetchone()
+        avg_rating, feedback_count = rating_summary(cursor, 'live_price', price_id)
         conn.close()
 
         return jsonify({
             'success': True,
             'feedbacks': feedbacks,
             'stats': {
-                'count': stats['count'],
-                'avg_rating': round(stats['avg_rating'], 1)
+                'count': feedback_count,
+                'avg_rating': round(avg_rating, 1)
             }
         }), 200
 
@@ -3913,6 +7135,21 @@ def get_live_price_feedback(price_id):
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+# ==========================================
+# METRICS API ROUTES
+# ==========================================
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Operational counters (connection pool, caches, workers) for scraping"""
+    try:
+        metrics = {name: provider() for name, provider in metrics_providers.items()}
+        return jsonify({'success': True, 'metrics': metrics}), 200
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 if __name__ == '__main__':
     # Enable debug mode for better error messages
     app.debug = True
@@ -0,0 +1,15 @@
+"""gunicorn settings, picked up automatically from the working directory
+
+The SSE streams (/api/live-prices/stream, /api/notifications/stream) and the
+notification long-poll keep a request open, so each worker serves requests
+on threads: a sync worker would be tied up by a single stream and killed by
+the default 30 s timeout.
+"""
+import os
+
+worker_class = 'gthread'
+# Every open stream occupies one thread of its worker
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+# Above the longest stream; clients reconnect with Last-Event-ID after it ends
+timeout = int(os.getenv('EVENT_STREAM_MAX_SECONDS', '300')) + 60
+graceful_timeout = 30
@@ -0,0 +1,60 @@
+"""
+Asset build check for the dashboard pages
+Splits index.html and dashboard.html the way 'flask build-assets' does and
+verifies that the shell keeps every script, in order, and every style rule
+"""
+import sys
+import os
+import re
+sys.path.insert(0, os.path.dirname(__file__))
+
+import app as farmer_app
+
+PAGES = ('index.html', 'dashboard.html')
+LAZY_SECTIONS = ('prices', 'ai-assistant', 'schemes')
+# External script tags emitted by the build
+INLINE_FREE = re.compile(r'<script src=[^>]*></script>')
+ASSET_REF = re.compile(r'(?:src|href)="' + re.escape(farmer_app.ASSET_URL_PREFIX) + r'([^"]+)"')
+
+
+def test_inline_assets_are_extracted_in_order():
+    print("=" * 60)
+    print("ASSET BUILD CHECK")
+    print("=" * 60)
+
+    for page in PAGES:
+        with open(os.path.join(os.path.dirname(__file__), page), encoding='utf-8') as f:
+            source = f.read()
+        stem = page.rsplit('.', 1)[0]
+        shell, assets = farmer_app.extract_inline_assets(source, stem)
+
+        referenced = ASSET_REF.findall(shell)
+        assert sorted(referenced) == sorted(assets), f'{page}: shell and assets disagree'
+        # Only content-hashed names are served as immutable
+        assert all(farmer_app.HASHED_ASSET_NAME.match(name) for name in assets), f'{page}: unhashed asset name'
+
+        # Stylesheet first (in <head>), then scripts in their original order
+        assert referenced[0].endswith('.css') and shell.index(referenced[0]) < shell.index('</head>')
+        scripts = [assets[name] for name in referenced if name.endswith('.js')]
+        positions = [source.index(content) for content in scripts]
+        assert positions == sorted(positions), f'{page}: scripts reordered'
+
+        # Nothing is lost: every script and style line comes from the page
+        assert all(content in source for content in scripts)
+        for line in assets[referenced[0]].split('\n'):
+            assert line in source
+        assert not re.search(r'<script>|<style>', INLINE_FREE.sub('', shell)), f'{page}: inline block left in shell'
+
+        if page == 'dashboard.html':
+            # Tab-specific scripts become placeholders for the lazy section loader
+            modules = re.findall(r'data-section-module="([\w-]+)"', shell)
+            assert modules == list(LAZY_SECTIONS), f'lazy sections: {modules}'
+
+        print(f"   ✓ {page}: {len(source) // 1024} KB -> {len(shell) // 1024} KB shell, {len(assets)} assets")
+    for name in ('manifest.json', 'pages/dashboard.html', 'pages/index.html'):
+        assert not farmer_app.HASHED_ASSET_NAME.match(name), f'{name} would be cached as immutable'
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    test_inline_assets_are_extracted_in_order()
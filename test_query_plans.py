@@ -0,0 +1,151 @@
+"""
+Query plan check for the hot API routes
+Runs every route against a scratch database, captures the SQL it executes
+and fails if EXPLAIN QUERY PLAN shows a full table scan without an index
+"""
+import sys
+import os
+import re
+import tempfile
+import zlib
+sys.path.insert(0, os.path.dirname(__file__))
+
+import app as farmer_app
+
+# GET routes the dashboard polls, plus the writes whose lookups run per request
+HOT_ROUTES = [
+    ('GET', '/api/user'),
+    ('GET', '/api/profile/full'),
+    ('GET', '/api/profile/stats'),
+    ('GET', '/api/profile/my-products'),
+    ('GET', '/api/profile/my-rentals'),
+    ('GET', '/api/profile/my-product-requirements'),
+    ('GET', '/api/profile/my-rental-requirements'),
+    ('GET', '/api/profile/feedback'),
+    ('GET', '/api/profile/my-feedback'),
+    ('GET', '/api/products'),
+    ('GET', '/api/products?limit=1&cursor=' + farmer_app.encode_cursor('2999-01-01 00:00:00', 1)),
+    ('GET', '/api/products/1/feedback'),
+    ('GET', '/api/requirements'),
+    ('GET', '/api/rental-requirements'),
+    ('GET', '/api/transactions'),
+    ('GET', '/api/notifications'),
+    ('GET', '/api/notifications?category=product_posted'),
+    ('GET', '/api/notifications/unread-count'),
+    ('GET', '/api/notifications/poll'),
+    ('GET', '/api/notifications/poll?after=0&timeout=0'),
+    ('PUT', '/api/notifications/read-all'),
+    ('GET', '/api/schemes'),
+    ('GET', '/api/rentals'),
+    ('GET', '/api/rentals/1'),
+    ('GET', '/api/rentals/1/feedback'),
+    ('GET', '/api/rentals/1/media'),
+    ('GET', '/api/history'),
+    ('GET', '/api/history/stats'),
+    ('GET', '/api/live-prices'),
+    ('GET', '/api/live-prices?district=d&category=grains'),
+    ('GET', '/api/live-prices?state=Telangana&limit=1&cursor=' + farmer_app.encode_cursor('2999-01-01 00:00:00', 1)),
+    ('GET', '/api/live-prices?product_name=paddy'),
+    ('GET', '/api/live-prices?category=grains&trend=stable&q=pad'),
+    ('GET', '/api/live-prices/1'),
+    ('GET', '/api/live-prices/1/feedback'),
+    ('GET', '/api/crop/details?crop=Paddy&sections=pests,irrigation'),
+]
+
+# "SCAN products" (no index) is a fallback; "SCAN products USING INDEX ..." is an ordered walk
+TABLE_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def seed(conn):
+    """Two users and one row in every table the routes read"""
+    cursor = conn.cursor()
+    for user_id, phone in ((1, '9000000001'), (2, '9000000002')):
+        cursor.execute('''
+            INSERT INTO users (id, name, phone, village, mandal, district, location, user_type, preferred_language, password)
+            VALUES (?, ?, ?, 'V', 'M', 'D', 'V, M, D', 'farmer', 'en', 'x')
+        ''', (user_id, f'User {user_id}', phone))
+    cursor.execute("INSERT INTO products (user_id, category, name, quantity, unit, price) VALUES (2, 'Grains', 'Paddy', 10, 'kg', 20)")
+    cursor.execute("INSERT INTO user_feedback (user_id, farmer_id, product_id, reviewer_name, rating) VALUES (1, 2, 1, 'User 1', 4)")
+    cursor.execute("INSERT INTO rental_items (user_id, name, category, price_per_day, location) VALUES (2, 'Tractor', 'Machinery', 900, 'D')")
+    cursor.execute("INSERT INTO rental_feedback (rental_id, user_id, reviewer_name, rating) VALUES (1, 1, 'User 1', 5)")
+    cursor.execute("INSERT INTO rental_media (rental_id, media_type, media_path) VALUES (1, 'image', '/static/x.jpg')")
+    cursor.execute("INSERT INTO customer_requirements (user_id, customer_name, product_name, quantity, location, phone_number) VALUES (1, 'User 1', 'Paddy', '5', 'D', '9000000001')")
+    cursor.execute("INSERT INTO rental_requirements (user_id, farmer_name, phone_number, rental_category, district) VALUES (1, 'User 1', '9000000001', 'Tractor', 'D')")
+    cursor.execute("INSERT INTO notifications (user_id, category, title, message) VALUES (1, 'product_posted', 'New', 'Paddy posted')")
+    cursor.execute("INSERT INTO announcements (category, title, message, exclude_user_id) VALUES ('product_posted', 'New', 'Paddy posted', 2)")
+    cursor.execute("INSERT INTO announcement_reads (user_id, announcement_id) VALUES (1, 1)")
+    cursor.execute("INSERT INTO user_history (user_id, action_type, item_type, item_name) VALUES (1, 'contacted', 'product', 'Paddy')")
+    cursor.execute("INSERT INTO transactions (user_id, type, description) VALUES (1, 'product_created', 'Created product')")
+    cursor.execute("INSERT INTO government_schemes (scheme_name) VALUES ('PM Kisan')")
+    cursor.execute("INSERT INTO live_prices (user_id, product_name, category, min_price, max_price, price_trend, phone) VALUES (2, 'Paddy', 'Grains', 18, 22, 'stable', '9000000002')")
+    cursor.execute("INSERT INTO live_price_feedback (price_id, user_id, rating) VALUES (1, 1, 5)")
+    cursor.execute("INSERT INTO crop_details (crop_key, language, crop_name, body) VALUES ('paddy', 'en', 'Paddy', ?)", (zlib.compress(b'guide'),))
+    cursor.execute("INSERT INTO crop_detail_sections (crop_key, language, section, body) VALUES ('paddy', 'en', 'pests', ?)", (zlib.compress(b'guide'),))
+    conn.commit()
+
+
+def table_scans(conn, sql):
+    """Plan rows that read a whole table without any index"""
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    return [row[3] for row in rows if TABLE_SCAN.match(row[3])]
+
+
+def test_hot_queries_use_indexes():
+    print("=" * 60)
+    print("HOT QUERY PLAN CHECK")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database = os.path.join(workdir, 'plans.db')
+        statements = []
+
+        class TracingPool(farmer_app.ConnectionPool):
+            def _connect(self):
+                conn = super()._connect()
+                conn.set_trace_callback(statements.append)
+                return conn
+
+        original_pool = farmer_app.db_pool
+        farmer_app.db_pool = TracingPool(database, 2)
+        try:
+            setup = farmer_app.db_pool.acquire()
+            farmer_app.apply_migrations(setup)
+            seed(setup)
+            setup.close()
+            statements.clear()
+
+            failures = []
+            with farmer_app.app.test_client() as client:
+                with client.session_transaction() as sess:
+                    sess['user_id'] = 1
+                for method, path in HOT_ROUTES:
+                    statements.clear()
+                    response = client.open(path, method=method)
+                    if response.status_code >= 400:
+                        failures.append((path, f'HTTP {response.status_code}'))
+                        continue
+                    route_sql = [s for s in statements if s.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH'))]
+                    check = farmer_app.db_pool.acquire()
+                    scans = []
+                    for sql in route_sql:
+                        scans.extend(f'{detail}  <-  {" ".join(sql.split())[:90]}' for detail in table_scans(check, sql))
+                    check.close()
+                    if scans:
+                        failures.extend((path, scan) for scan in scans)
+                        print(f"   ✗ {method} {path}")
+                    else:
+                        print(f"   ✓ {method} {path} ({len(route_sql)} queries)")
+        finally:
+            tracing_pool = farmer_app.db_pool
+            farmer_app.db_pool = original_pool
+            while not tracing_pool.idle.empty():
+                tracing_pool.idle.get_nowait().discard()
+
+    for path, detail in failures:
+        print(f"     {path}: {detail}")
+    print("=" * 60)
+    assert not failures, f'{len(failures)} hot queries fall back to a table scan'
+
+
+if __name__ == '__main__':
+    test_hot_queries_use_indexes()
@@ -0,0 +1,50 @@
+"""
+Upstream rate budget check
+Runs RateBudget against a scratch database and verifies that a reservation
+past its deadline fails without spending a token, even when one is free,
+and that a refunded token can be reserved again
+"""
+import sys
+import os
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+
+import app as farmer_app
+
+
+def test_reserve_respects_deadline_before_taking():
+    print("=" * 60)
+    print("RATE BUDGET CHECK")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        original_pool = farmer_app.db_pool
+        farmer_app.db_pool = farmer_app.ConnectionPool(os.path.join(workdir, 'budget.db'), 2)
+        try:
+            setup = farmer_app.db_pool.acquire()
+            farmer_app.apply_migrations(setup)
+            setup.close()
+
+            budget = farmer_app.RateBudget('test', per_minute=1, burst=1)
+            assert not budget.reserve(deadline=time.time() - 1), 'reserved after the deadline'
+            print("   ✓ expired deadline refused")
+            # The refused call left the only token in the bucket
+            assert budget.reserve(deadline=time.time() + 60)
+            assert budget.stats()['reserved'] == 1
+            print("   ✓ token still available afterwards")
+            # The bucket is empty now; a refund makes the next reservation immediate
+            assert not budget.reserve(deadline=time.time() + 0.5)
+            budget.refund()
+            assert budget.reserve(deadline=time.time() + 0.5)
+            print("   ✓ refunded token reserved again")
+        finally:
+            budget_pool = farmer_app.db_pool
+            farmer_app.db_pool = original_pool
+            while not budget_pool.idle.empty():
+                budget_pool.idle.get_nowait().discard()
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    test_reserve_respects_deadline_before_taking()
@@ -0,0 +1,63 @@
+"""
+Semantic answer cache check
+Scores question pairs the way SemanticAnswerIndex does and pins questions
+that differ in one meaningful word (stage, with/without, when/how) below the
+reuse threshold, while rewordings (reordered, plural, local names) still
+reuse the cached answer
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+import app as farmer_app
+
+# Same wording except for the part that changes the answer
+NEAR_MISSES = [
+    ('How much fertilizer for rice at the tillering stage',
+     'How much fertilizer for rice at the flowering stage'),
+    ('control pests in tomato without chemicals',
+     'control pests in tomato with chemicals'),
+    ('when to sow rice', 'how to sow rice'),
+]
+# Spelling, plural, word order, local name and filler differences only
+REWORDINGS = [
+    ('Best fertiliser for paddy?', 'best fertilizers for rice'),
+    ('How to control pests in chillies', 'how can I control pest in chili crop'),
+    ('paddy fertilizer', 'fertilizer for rice crop'),
+    ('best fertilizer for paddy', 'paddy fertilizer'),
+    ('tomato price today', 'price of tomato today'),
+    ('how to grow tomato', 'how to grow tomatoes'),
+    ('potato varieties for winter', 'winter variety of potatoes'),
+]
+
+
+def similarity(first, second):
+    """Cosine score as SemanticAnswerIndex.lookup sees it (0 when the intent words differ)"""
+    if farmer_app.semantic_intent(first) != farmer_app.semantic_intent(second):
+        return 0.0
+    a = farmer_app.semantic_vector(first)
+    b = farmer_app.semantic_vector(second)
+    return sum(weight * b.get(bucket, 0.0) for bucket, weight in a.items())
+
+
+def test_near_miss_questions_do_not_share_answers():
+    print("=" * 60)
+    print("SEMANTIC CACHE CHECK")
+    print("=" * 60)
+    threshold = farmer_app.AI_SEMANTIC_THRESHOLD
+    assert threshold > 0.85
+
+    for first, second in NEAR_MISSES:
+        score = similarity(first, second)
+        print(f"   {score:.2f}  {first!r} ~ {second!r}")
+        assert score < threshold, f'{first!r} would reuse the answer to {second!r}'
+
+    for first, second in REWORDINGS:
+        score = similarity(first, second)
+        print(f"   {score:.2f}  {first!r} = {second!r}")
+        assert score >= threshold, f'{first!r} should reuse the answer to {second!r}'
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    test_near_miss_questions_do_not_share_answers()
@@ -0,0 +1,178 @@
+"""
+Upstream client check
+Drives UpstreamClient with a stubbed _post and verifies the circuit breaker
+(closed -> open -> half_open with a single probe), that model and HTTP
+errors release the breaker without counting as outages, model demotion,
+and that HTTP retries are charged to the budget and kept short
+"""
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+
+import app as farmer_app
+
+MODELS = ['model-a', 'model-b', 'model-c']
+
+
+class FakeResponse:
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+
+def ok(text='answer'):
+    return FakeResponse(200, {'choices': [{'message': {'content': text}}]})
+
+
+def error(status_code, message):
+    return FakeResponse(status_code, {'error': {'message': message}})
+
+
+def make_client(reply, threshold=2, reset_seconds=0.05):
+    """Client whose _post answers reply(model) and records the models tried"""
+    client = farmer_app.UpstreamClient('test', 'http://upstream.invalid', 'key', MODELS)
+    client.breaker = farmer_app.CircuitBreaker(threshold, reset_seconds)
+    client.tried = []
+
+    def post(payload, timeout, on_attempt=None):
+        client.tried.append(payload['model'])
+        return reply(payload['model'])
+
+    client._post = post
+    return client
+
+
+def expect_error(client, kind):
+    try:
+        client.complete([{'role': 'user', 'content': 'hi'}])
+    except farmer_app.UpstreamError as e:
+        assert e.kind == kind, f'expected {kind}, got {e.kind}'
+        return e
+    raise AssertionError(f'expected UpstreamError({kind})')
+
+
+def test_circuit_opens_and_probes_once():
+    client = make_client(lambda model: error(503, 'unavailable'))
+    expect_error(client, 'outage')
+    assert client.breaker.state == 'closed'
+    expect_error(client, 'outage')
+    assert client.breaker.state == 'open'
+
+    # Open: fails fast without calling the upstream
+    assert client.breaker.is_open()
+    client.tried.clear()
+    assert expect_error(client, 'open').retry_after >= 1
+    assert client.tried == []
+
+    # After the reset period exactly one probe goes out; is_open() does not claim it
+    time.sleep(0.06)
+    assert not client.breaker.is_open() and not client.breaker.probing
+    nested = []
+
+    def probe(model):
+        nested.append(expect_error(client, 'open'))
+        return ok()
+
+    client._post = lambda payload, timeout, on_attempt=None: probe(payload['model'])
+    assert client.complete([{'role': 'user', 'content': 'hi'}]) == 'answer'
+    assert len(nested) == 1, 'a second call got through while probing'
+    assert client.breaker.state == 'closed' and client.breaker.failures == 0
+    print("   ✓ closed -> open -> half_open single probe -> closed")
+
+
+def test_failed_probe_reopens():
+    client = make_client(lambda model: error(503, 'unavailable'), threshold=1)
+    expect_error(client, 'outage')
+    time.sleep(0.06)
+    expect_error(client, 'outage')
+    assert client.breaker.state == 'open'
+    expect_error(client, 'open')
+    print("   ✓ failed probe reopens the circuit")
+
+
+def test_model_and_http_errors_release_the_probe():
+    for reply, kind in ((lambda model: error(400, 'Invalid model'), 'model'),
+                        (lambda model: error(401, 'Unauthorized'), 'http')):
+        client = make_client(lambda model: error(503, 'unavailable'), threshold=1)
+        expect_error(client, 'outage')
+        time.sleep(0.06)
+        client._post = lambda payload, timeout, on_attempt=None, reply=reply: reply(payload['model'])
+        expect_error(client, kind)
+        # Not an outage: still half_open, and the next call may probe again
+        assert client.breaker.state == 'half_open' and not client.breaker.probing
+        assert client.breaker.allow()
+        client.breaker.release()
+
+        client = make_client(reply, threshold=1)
+        expect_error(client, kind)
+        assert client.breaker.state == 'closed' and client.breaker.failures == 0
+    print("   ✓ model and HTTP errors release without opening")
+
+
+def test_model_demotion_order():
+    client = make_client(lambda model: error(400, 'Invalid model') if model == 'model-a' else ok(model))
+    assert client.complete([{'role': 'user', 'content': 'hi'}]) == 'model-b'
+    assert client.tried == ['model-a', 'model-b']
+    # Last working model first; the demoted model is skipped while others work
+    assert client.candidates() == ['model-b', 'model-c']
+
+    client.tried.clear()
+    client.complete([{'role': 'user', 'content': 'hi'}])
+    assert client.tried == ['model-b']
+
+    # With every model demoted they are all still tried, in configured order
+    client._demote('model-b')
+    client._demote('model-c')
+    assert client.candidates() == ['model-a', 'model-b', 'model-c']
+    print("   ✓ demoted models are skipped until nothing else is left")
+
+
+class CountingBudget:
+    def __init__(self):
+        self.charged = 0
+
+    def charge(self):
+        self.charged += 1
+
+
+def test_retries_are_charged_and_bounded():
+    client = farmer_app.UpstreamClient('test', 'http://upstream.invalid', 'key', MODELS[:1], CountingBudget())
+    session = client.http._session()
+
+    def serve(*replies):
+        queue = list(replies)
+        session.post = lambda url, **kwargs: queue.pop(0)
+
+    # A 5xx is retried, and each request sent is charged
+    serve(FakeResponse(503, {}, {'Retry-After': '0'}), ok())
+    assert client.complete([{'role': 'user', 'content': 'hi'}]) == 'answer'
+    assert client.budget.charged == 2
+
+    # charge=False: the caller reserved the first request, the retry is still charged
+    serve(FakeResponse(503, {}, {'Retry-After': '0'}), ok())
+    client.complete([{'role': 'user', 'content': 'hi'}], charge=False)
+    assert client.budget.charged == 3
+
+    # 429 goes straight to the breaker; a long Retry-After is not slept on
+    for status, headers in ((429, {}), (503, {'Retry-After': '60'})):
+        serve(FakeResponse(status, {}, headers), ok())
+        expect_error(client, 'outage')
+    assert client.budget.charged == 5
+    print("   ✓ retries charged per request, 429 and long waits not retried")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("UPSTREAM CLIENT CHECK")
+    print("=" * 60)
+    test_circuit_opens_and_probes_once()
+    test_failed_probe_reopens()
+    test_model_and_http_errors_release_the_probe()
+    test_model_demotion_order()
+    test_retries_are_charged_and_bounded()
+    print("=" * 60)